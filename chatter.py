@@ -112,7 +112,7 @@ class PrefrontalCortexChatter(BaseChatter):
             chat_history_str = await build_readable_messages(
                 initial_messages, replace_bot_name=True, merge_messages=False, timestamp_mode="relative", read_mark=0.0)
 
-            session.observation_info.chat_history = []
+            session.observation_info.chat_history.clear()
             for msg in initial_messages:
                 sender_id = str(msg.get("user_id", ""))
                 content = msg.get("processed_plain_text", "") or msg.get("display_message", "")
@@ -144,13 +144,13 @@ class PrefrontalCortexChatter(BaseChatter):
 
     async def _build_chat_history_str(self, session: PFCSession, user_name: str) -> None:
         """构建聊天历史字符串"""
-        from .shared import translate_timestamp
+        from .shared import take_last, translate_timestamp
         from src.config.config import global_config
 
         bot_name = global_config.bot.nickname if global_config else "Bot"
         formatted_blocks = []
 
-        for msg in session.observation_info.chat_history[-30:]:
+        for msg in take_last(session.observation_info.chat_history, 30):
             msg_type = msg.get("type", "")
             if msg_type not in ["user_message", "bot_message"]:
                 continue
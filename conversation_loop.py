@@ -2,20 +2,61 @@
 
 from __future__ import annotations
 import asyncio
-import datetime
+import contextlib
+import re
 import time
+from collections import Counter
 from typing import Callable, Awaitable, Dict, Optional, TYPE_CHECKING
 
 from src.common.logger import get_logger
 from src.config.config import global_config
+from src.plugin_system.apis import send_api
+from .context_builder import PFCContextBuilder
+from .goal_analyzer import GoalAnalyzer
+from .knowledge_fetcher import KnowledgeFetcher
 from .models import ConversationState, ConversationInfo
+from .planner import ActionPlanner
+from .replyer import ReplyChecker, ReplyGenerator
 from .session import PFCSession
+from .shared import PersonalityHelper, TTLCache, format_chat_history
 
 if TYPE_CHECKING:
     from .plugin import PFCConfig
 
 logger = get_logger("pfc_loop")
 
+# 从规划理由中提取工具名称的常见模式（按优先级排列）
+_TOOL_NAME_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'使用\s*[「"\'`]?(\w+)[」"\'`]?\s*工具',
+        r'调用\s*[「"\'`]?(\w+)[」"\'`]?',
+        r'工具[：:]\s*[「"\'`]?(\w+)[」"\'`]?',
+        r'tool[：:]\s*[「"\'`]?(\w+)[」"\'`]?',
+        r'(\w+_\w+)',  # 匹配下划线分隔的工具名
+    )
+]
+
+# 行动分发表中的占位参数，表示传入规划理由
+_PLAN_REASON = object()
+
+# 执行后不一定改变规划缓存键、但会影响下一步规划的行动，执行后清空规划缓存
+_PLAN_CACHE_INVALIDATING_ACTIONS = frozenset({"rethink_goal", "fetch_knowledge"})
+
+
+def _now_hms() -> str:
+    """当前本地时间的 HH:MM:SS 字符串（比 strftime 更轻量）"""
+    t = time.localtime()
+    return f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
+
+
+async def _cancel_and_wait(task: asyncio.Task, msg: Optional[str] = None) -> None:
+    """取消任务并等待其真正结束（已结束的任务直接返回）"""
+    if task.done():
+        return
+    task.cancel(msg=msg)
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
 
 # ============================================================================
 # 等待器类 (原 waiter.py)
@@ -28,6 +69,7 @@ class Waiter:
                  new_message_checker: Optional[Callable[[float], Awaitable[bool]]] = None):
         self.stream_id = stream_id
         self.private_name = private_name
+        self.log_prefix = f"[私聊][{private_name}]"
         self.config = config
         self.bot_name = global_config.bot.nickname if global_config else "Bot"
         self._new_message_checker = new_message_checker
@@ -40,16 +82,18 @@ class Waiter:
     async def wait(self, conversation_info: ConversationInfo) -> bool:
         """等待用户新消息或超时，返回True表示超时"""
         wait_start_time = time.time()
-        logger.info(f"[私聊][{self.private_name}]进入常规等待状态 (超时: {self.timeout_seconds} 秒)...")
+        clock = asyncio.get_running_loop().time  # 已等待时长使用事件循环的单调时钟计算
+        started_at = clock()
+        logger.info(f"{self.log_prefix}进入常规等待状态 (超时: {self.timeout_seconds} 秒)...")
 
         while True:
             if await self._check_new_message(wait_start_time):
-                logger.info(f"[私聊][{self.private_name}]等待结束，收到新消息")
+                logger.info(f"{self.log_prefix}等待结束，收到新消息")
                 return False
 
-            elapsed_time = time.time() - wait_start_time
+            elapsed_time = clock() - started_at
             if elapsed_time > self.timeout_seconds:
-                logger.info(f"[私聊][{self.private_name}]等待超过 {self.timeout_seconds} 秒...添加思考目标。")
+                logger.info(f"{self.log_prefix}等待超过 {self.timeout_seconds} 秒...添加思考目标。")
                 conversation_info.goal_list.append({
                     "goal": f"你等待了{elapsed_time / 60:.1f}分钟，注意可能在对方看来聊天已经结束，思考接下来要做什么",
                     "reasoning": "对方很久没有回复你的消息了",
@@ -61,16 +105,18 @@ class Waiter:
     async def wait_listening(self, conversation_info: ConversationInfo) -> bool:
         """倾听用户发言或超时，返回True表示超时"""
         wait_start_time = time.time()
-        logger.info(f"[私聊][{self.private_name}]进入倾听等待状态 (超时: {self.timeout_seconds} 秒)...")
+        clock = asyncio.get_running_loop().time  # 已等待时长使用事件循环的单调时钟计算
+        started_at = clock()
+        logger.info(f"{self.log_prefix}进入倾听等待状态 (超时: {self.timeout_seconds} 秒)...")
 
         while True:
             if await self._check_new_message(wait_start_time):
-                logger.info(f"[私聊][{self.private_name}]倾听等待结束，收到新消息")
+                logger.info(f"{self.log_prefix}倾听等待结束，收到新消息")
                 return False
 
-            elapsed_time = time.time() - wait_start_time
+            elapsed_time = clock() - started_at
             if elapsed_time > self.timeout_seconds:
-                logger.info(f"[私聊][{self.private_name}]倾听等待超过 {self.timeout_seconds} 秒...添加思考目标。")
+                logger.info(f"{self.log_prefix}倾听等待超过 {self.timeout_seconds} 秒...添加思考目标。")
                 conversation_info.goal_list.append({
                     "goal": f"你等待了{elapsed_time / 60:.1f}分钟，对方似乎话说一半突然消失了，思考接下来要做什么",
                     "reasoning": "对方话说一半消失了，很久没有回复",
@@ -89,7 +135,7 @@ class Waiter:
             try:
                 return await self._new_message_checker(since_time)
             except Exception as e:
-                logger.error(f"[私聊][{self.private_name}]检查新消息时出错: {e}")
+                logger.error(f"{self.log_prefix}检查新消息时出错: {e}")
         return False
 
 
@@ -101,191 +147,372 @@ class Waiter:
 class ConversationLoop:
     """单个会话的持续循环"""
 
+    # 行动 -> (处理方法名, 额外参数)；额外参数为 _PLAN_REASON 时传入规划理由
+    _ACTION_HANDLERS: Dict[str, tuple] = {
+        "direct_reply": ("_handle_reply_action", "direct_reply"),
+        "send_new_message": ("_handle_reply_action", "send_new_message"),
+        "fetch_knowledge": ("_handle_fetch_knowledge", _PLAN_REASON),
+        "rethink_goal": ("_handle_rethink_goal", None),
+        "listening": ("_handle_listening", None),
+        "wait": ("_handle_wait", None),
+        "say_goodbye": ("_handle_say_goodbye", None),
+        "end_conversation": ("_handle_end_conversation", None),
+        "block_and_ignore": ("_handle_block_and_ignore", None),
+        "use_tool": ("_handle_use_tool", _PLAN_REASON),
+    }
+
     def __init__(self, session: PFCSession, user_name: str):
         self.session = session
         self.user_name = user_name
+        self.log_prefix = f"[PFC][{user_name}]"  # 日志前缀只构建一次
+        self._personality_helper = PersonalityHelper(user_name)
         from .plugin import get_config
         self.config = get_config()
         self._task: Optional[asyncio.Task] = None
+        self._aio_loop: Optional[asyncio.AbstractEventLoop] = None  # start() 时绑定，子任务都创建在该事件循环上
         self._running = False
         self._interrupt_event = asyncio.Event()  # 新消息中断事件
-        self._planning_task: Optional[asyncio.Task] = None  # 当前规划任务
+        # 规划缓存：目标与最近聊天记录未变化时复用上次规划结果
+        self._plan_cache = TTLCache(maxsize=64, ttl=self.config.planner.plan_cache_ttl_seconds)
+        # 推测执行：规划期间提前进行可能的下一步（仅限无副作用的目标分析请求）
+        self._goal_analyzer = None
+        self._knowledge_fetcher: Optional[KnowledgeFetcher] = None  # 复用以保留其记忆检索与历史渲染缓存
+        self._speculative_goal_task: Optional[asyncio.Task] = None
+        # 进行中的子任务（LLM 请求等），停止循环时统一取消
+        self._inflight: set[asyncio.Task] = set()
+        self._interrupt_waiter: Optional[asyncio.Task] = None  # 常驻的中断等待任务
+        self._llm_timeout = self.config.planner.llm_timeout_seconds
+        # 规划令牌桶：限制每秒的规划与行动次数（消息连发时的重新规划也受其约束）
+        self._plan_token_capacity = max(1, self.config.planner.rate_limit_burst)
+        self._plan_token_rate = 1.0 / max(self.config.planner.rate_limit_refill_seconds, 0.001)
+        self._plan_tokens = float(self._plan_token_capacity)
+        self._plan_tokens_refilled_at = time.monotonic()
 
     async def start(self):
         if self._running:
             return
         self._running = True
-        self._task = asyncio.create_task(self._loop())
-        logger.info(f"[PFC][{self.user_name}] 会话循环已启动")
+        self._aio_loop = asyncio.get_running_loop()
+        self._task = self._aio_loop.create_task(self._loop())
+        logger.info(f"{self.log_prefix} 会话循环已启动")
 
     async def stop(self):
         self._running = False
-        self._interrupt_event.set()  # 触发中断事件
-        if self._planning_task and not self._planning_task.done():
-            self._planning_task.cancel()
+        self._speculative_goal_task = None
+        # 规划、生成、推测与中断等待任务都登记在 _inflight 中，这里统一取消一次，
+        # 避免停止后继续占用网络与配额
+        for task in list(self._inflight):
+            task.cancel()
         if self._task:
-            self._task.cancel()
-            try:
-                await self._task
-            except asyncio.CancelledError:
-                pass
+            await _cancel_and_wait(self._task, msg="stop requested")
             self._task = None
-        logger.info(f"[PFC][{self.user_name}] 会话循环已停止")
+        logger.info(f"{self.log_prefix} 会话循环已停止")
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """创建受循环管理的子任务，stop() 时会被一并取消"""
+        task = self._aio_loop.create_task(coro)
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        return task
+
+    def _get_interrupt_waiter(self) -> asyncio.Task:
+        """获取常驻的中断等待任务，仅在上一个已结束时重新创建"""
+        if self._interrupt_waiter is None or self._interrupt_waiter.done():
+            self._interrupt_waiter = self._spawn(self._interrupt_event.wait())
+        return self._interrupt_waiter
+
+    async def _wait_interruptible(self, task: asyncio.Task) -> bool:
+        """等待任务完成或被新消息中断（不会取消任务）
+
+        Returns:
+            是否被中断
+        """
+        while True:
+            waiter = self._get_interrupt_waiter()
+            if not task.done() and not waiter.done():
+                # 两个任务共用一个唤醒 Future，避免 asyncio.wait 每次调用的集合与回调开销
+                wakeup = self._aio_loop.create_future()
+
+                def _wake(_):
+                    if not wakeup.done():
+                        wakeup.set_result(None)
+
+                task.add_done_callback(_wake)
+                waiter.add_done_callback(_wake)
+                try:
+                    await wakeup
+                finally:
+                    task.remove_done_callback(_wake)
+                    waiter.remove_done_callback(_wake)
+            if self._interrupt_event.is_set():
+                return True
+            if task.done():
+                return False
+            # 等待任务因已被清除的旧事件唤醒，换一个新的继续等
+
+    async def _pause(self, timeout: float) -> None:
+        """至多等待 timeout 秒，期间有新消息到达时立即返回"""
+        if self._interrupt_event.is_set():
+            return
+        await asyncio.wait({self._get_interrupt_waiter()}, timeout=timeout)
 
     def notify_new_message(self):
         """通知循环有新消息到达，触发中断"""
         self._interrupt_event.set()
-        logger.debug(f"[PFC][{self.user_name}] 收到新消息通知，触发中断事件")
+        # 新消息使此前的规划全部失效
+        self._plan_cache.clear()
+        logger.debug(f"{self.log_prefix} 收到新消息通知，触发中断事件")
 
     async def _loop(self):
         """PFC核心循环"""
-        while self._running and self.session.should_continue:
-            # 忽略逻辑
-            if self.session.ignore_until_timestamp:
-                if time.time() < self.session.ignore_until_timestamp:
-                    await asyncio.sleep(30)
+        try:
+            while self._running and self.session.should_continue:
+                # 忽略逻辑
+                if self.session.ignore_until_timestamp:
+                    if time.time() < self.session.ignore_until_timestamp:
+                        await asyncio.sleep(30)
+                        continue
+                    logger.info(f"{self.log_prefix} 忽略时间已到，清除忽略状态")
+                    self.session.ignore_until_timestamp = None
+                    if self.session.observation_info.new_messages_count == 0:
+                        self.session.should_continue = False
                     continue
-                logger.info(f"[PFC][{self.user_name}] 忽略时间已到，清除忽略状态")
-                self.session.ignore_until_timestamp = None
-                if self.session.observation_info.new_messages_count == 0:
-                    self.session.should_continue = False
-                continue
 
-            try:
-                # 清除中断事件，准备新一轮规划
-                self._interrupt_event.clear()
-                initial_new_message_count = self.session.observation_info.new_messages_count + 1
-
-                from .planner import ActionPlanner
-                planner = ActionPlanner(self.session, self.user_name)
-                
-                # 使用可中断的方式执行规划
-                self._planning_task = asyncio.create_task(planner.plan())
+                did_work = False
                 try:
-                    # 等待规划完成或被中断
-                    done, pending = await asyncio.wait(
-                        [self._planning_task, asyncio.create_task(self._interrupt_event.wait())],
-                        return_when=asyncio.FIRST_COMPLETED
-                    )
-                    
-                    # 检查是否被中断
-                    if self._interrupt_event.is_set():
-                        # 取消规划任务
-                        if not self._planning_task.done():
-                            self._planning_task.cancel()
-                            try:
-                                await self._planning_task
-                            except asyncio.CancelledError:
-                                pass
-                        logger.info(f"[PFC][{self.user_name}] 规划被新消息中断，重新规划")
-                        self.session.conversation_info.last_successful_reply_action = None
-                        # 取消等待任务
-                        for task in pending:
-                            task.cancel()
-                            try:
-                                await task
-                            except asyncio.CancelledError:
-                                pass
-                        await asyncio.sleep(0.1)
-                        continue
-                    
-                    # 获取规划结果
-                    action, reason = self._planning_task.result()
-                    # 取消等待任务
-                    for task in pending:
-                        task.cancel()
+                    # 令牌不足时先等待，期间到达的消息会合并到同一轮规划；
+                    # 每一轮（无论调用规划器还是命中缓存）都消耗一个令牌，从而限制每秒执行的行动数
+                    await self._wait_for_plan_token()
+                    self._plan_tokens -= 1
+
+                    # 清除中断事件，准备新一轮规划
+                    self._interrupt_event.clear()
+                    initial_new_message_count = self.session.observation_info.new_messages_count + 1
+
+                    state_key = self._plan_cache_key()
+                    plan_key = state_key if self.config.planner.plan_cache_enabled else None
+                    cached_plan = self._plan_cache.get(plan_key) if plan_key is not None else None
+                    if cached_plan:
+                        action, reason = cached_plan
+                        logger.debug(f"{self.log_prefix} 命中规划缓存: {action}")
+                    else:
+                        planner = ActionPlanner(self.session, self.user_name)
+                        if self.config.planner.speculative_prefetch:
+                            self._start_speculation()
+
+                        # 使用可中断的方式执行规划；中断时只取消规划本身，常驻的中断等待任务保持不动
+                        planning_task = self._spawn(asyncio.wait_for(planner.plan(), self._llm_timeout))
+                        if await self._wait_interruptible(planning_task):
+                            await _cancel_and_wait(planning_task)
+                            logger.info(f"{self.log_prefix} 规划被新消息中断，重新规划")
+                            self.session.conversation_info.last_successful_reply_action = None
+                            self._cancel_speculation()
+                            continue
+
+                        # 获取规划结果
                         try:
-                            await task
-                        except asyncio.CancelledError:
-                            pass
-                finally:
-                    self._planning_task = None
-
-                current_new_message_count = self.session.observation_info.new_messages_count
-                # 降低阈值：只要有新消息就重新规划
-                if current_new_message_count > initial_new_message_count:
-                    logger.info(f"[PFC][{self.user_name}] 规划期间发现新增消息 ({initial_new_message_count} -> {current_new_message_count})，重新规划")
-                    self.session.conversation_info.last_successful_reply_action = None
-                    await asyncio.sleep(0.1)
-                    continue
+                            action, reason = planning_task.result()
+                        except asyncio.TimeoutError:
+                            logger.warning(f"{self.log_prefix} 行动规划超时 ({self._llm_timeout} 秒)")
+                            action, reason = "wait", "行动规划超时"
 
-                if initial_new_message_count > 0 and action in ["direct_reply", "send_new_message"]:
-                    await self.session.clear_unprocessed_messages()
-                    self.session.observation_info.new_messages_count = 0
+                        if plan_key is not None:
+                            self._plan_cache.set(plan_key, (action, reason))
 
-                await self._handle_action(action, reason)
-
-                # 检查结束对话目标
-                for goal_item in (self.session.conversation_info.goal_list or []):
-                    if isinstance(goal_item, dict) and goal_item.get("goal") == "结束对话":
-                        self.session.should_continue = False
-                        logger.info(f"[PFC][{self.user_name}] 检测到'结束对话'目标，停止循环")
+                    if not self._running:
                         break
 
-            except Exception as e:
-                logger.error(f"[PFC][{self.user_name}] PFC主循环出错: {e}")
-                await asyncio.sleep(1)
-
-            if self.session.should_continue:
-                await asyncio.sleep(0.1)
+                    current_new_message_count = self.session.observation_info.new_messages_count
+                    # 降低阈值：只要有新消息就重新规划
+                    if current_new_message_count > initial_new_message_count:
+                        logger.info(f"{self.log_prefix} 规划期间发现新增消息 ({initial_new_message_count} -> {current_new_message_count})，重新规划")
+                        self.session.conversation_info.last_successful_reply_action = None
+                        self._cancel_speculation()
+                        continue
 
+                    # 预测落空或规划期间状态已变化时丢弃推测结果
+                    if action != "rethink_goal" or self._plan_cache_key() != state_key:
+                        self._cancel_speculation()
+
+                    if initial_new_message_count > 0 and action in ["direct_reply", "send_new_message"]:
+                        drained = await self.session.drain_and_reset()
+                        logger.debug(f"{self.log_prefix} 已将 {drained} 条新消息并入聊天历史")
+
+                    await self._handle_action(action, reason)
+                    if action in _PLAN_CACHE_INVALIDATING_ACTIONS:
+                        self._plan_cache.clear()
+                    did_work = action not in ("wait", "listening")
+
+                    # 检查结束对话目标（目标列表为空时直接跳过）
+                    if goal_list := self.session.conversation_info.goal_list:
+                        for goal_item in goal_list:
+                            if isinstance(goal_item, dict) and goal_item.get("goal") == "结束对话":
+                                self.session.should_continue = False
+                                logger.info(f"{self.log_prefix} 检测到'结束对话'目标，停止循环")
+                                break
+
+                except Exception as e:
+                    logger.error(f"{self.log_prefix} PFC主循环出错: {e}")
+                    self._cancel_speculation()
+                    await asyncio.sleep(1)
+
+                if self.session.should_continue:
+                    # 刚完成实际工作时只让出一次调度；等待类行动后保留短暂间隔，新消息到达则立即进入下一轮
+                    if did_work:
+                        await asyncio.sleep(0)
+                    else:
+                        await self._pause(0.1)
+        finally:
+            # 循环自行结束（should_continue 为假）时管理器不会调用 stop()，在这里取消
+            # 常驻的中断等待任务、推测任务等仍在进行的子任务，避免遗留挂起的任务
+            self._speculative_goal_task = None
+            self._interrupt_waiter = None
+            for task in list(self._inflight):
+                task.cancel()
         self._running = False
-        logger.info(f"[PFC][{self.user_name}] PFC循环结束")
+        logger.info(f"{self.log_prefix} PFC循环结束")
+
+    def _refill_plan_tokens(self):
+        now = time.monotonic()
+        elapsed = now - self._plan_tokens_refilled_at
+        self._plan_tokens = min(self._plan_token_capacity, self._plan_tokens + elapsed * self._plan_token_rate)
+        self._plan_tokens_refilled_at = now
+
+    async def _wait_for_plan_token(self):
+        """等待规划令牌桶中至少有一个令牌"""
+        self._refill_plan_tokens()
+        if self._plan_tokens < 1:
+            delay = (1 - self._plan_tokens) / self._plan_token_rate
+            logger.debug(f"{self.log_prefix} 规划过于频繁，等待 {delay:.1f} 秒")
+            await asyncio.sleep(delay)
+            self._refill_plan_tokens()
+
+    def _plan_cache_key(self) -> tuple:
+        """规划缓存键：当前目标、最近聊天记录与上一步行动状态
+
+        新消息到达或目标变化会改变键值，从而绕过缓存重新规划；缓存在状态未变的
+        重复规划（如连续的等待/倾听轮次）时命中。重新思考目标与获取知识不一定改变
+        键值（目标文本相同、知识列表已满），执行后会显式清空缓存。
+        """
+        conversation_info = self.session.conversation_info
+        observation_info = self.session.observation_info
+        goal_list = conversation_info.goal_list
+        current_goal = goal_list[0].get("goal", "") if goal_list and isinstance(goal_list[0], dict) else ""
+        last_action = conversation_info.done_action[-1] if conversation_info.done_action else {}
+        return (
+            current_goal,
+            observation_info.chat_history_str[-512:],
+            observation_info.new_messages_count,
+            conversation_info.last_successful_reply_action,
+            last_action.get("action"),
+            last_action.get("status"),
+            len(conversation_info.knowledge_list or ()),
+            len(conversation_info.tool_results or ()),
+        )
+
+    def _get_goal_analyzer(self):
+        """获取本会话复用的目标分析器"""
+        if self._goal_analyzer is None:
+            self._goal_analyzer = GoalAnalyzer(self.session)
+        return self._goal_analyzer
+
+    def _get_knowledge_fetcher(self) -> KnowledgeFetcher:
+        """获取本会话复用的知识获取器"""
+        if self._knowledge_fetcher is None:
+            self._knowledge_fetcher = KnowledgeFetcher(self.user_name, self.config)
+        else:
+            self._knowledge_fetcher.private_name = self.user_name
+        return self._knowledge_fetcher
+
+    def _predict_next_action(self) -> Optional[str]:
+        """根据历史行动的转移频率预测下一步行动"""
+        actions = [record.get("action") for record in self.session.conversation_info.done_action]
+        if not actions:
+            return None
+        last_action = actions[-1]
+        followers = Counter(nxt for prev, nxt in zip(actions, actions[1:]) if prev == last_action)
+        return followers.most_common(1)[0][0] if followers else None
+
+    def _start_speculation(self):
+        """预测下一步为重新思考目标时，在规划期间提前请求目标分析"""
+        if self._speculative_goal_task is not None or self._predict_next_action() != "rethink_goal":
+            return
+        self._speculative_goal_task = self._spawn(
+            asyncio.wait_for(self._get_goal_analyzer().generate_goal_response(), self._llm_timeout))
+        logger.debug(f"{self.log_prefix} 预测下一步为 rethink_goal，提前进行目标分析")
+
+    def _cancel_speculation(self):
+        if self._speculative_goal_task is not None:
+            self._speculative_goal_task.cancel()
+            self._speculative_goal_task = None
+
+    async def _consume_speculation(self) -> Optional[str]:
+        """取出推测执行的目标分析结果，失败或为空时返回 None"""
+        task, self._speculative_goal_task = self._speculative_goal_task, None
+        if task is None:
+            return None
+        try:
+            return await task or None
+        except asyncio.CancelledError:
+            # 只有推测任务自身被取消时才视为推测失败；循环任务被取消（stop()）时会先取消
+            # 正在等待的推测任务，此时 task.cancelled() 同样为真，需按外层 cancelling() 区分并继续抛出
+            if not task.cancelled() or asyncio.current_task().cancelling():
+                raise
+            return None
+        except Exception as e:
+            logger.warning(f"{self.log_prefix} 推测目标分析失败，改为现场分析: {e}")
+            return None
 
     def _check_new_messages_after_planning(self) -> bool:
         if self.session.observation_info.new_messages_count > 2:
-            logger.info(f"[PFC][{self.user_name}] 生成期间收到新消息，取消当前动作")
+            logger.info(f"{self.log_prefix} 生成期间收到新消息，取消当前动作")
             self.session.conversation_info.last_successful_reply_action = None
             return True
         return False
 
     async def _handle_action(self, action: str, reason: str):
         """处理规划的行动"""
-        current_action_record = {
+        # 处理器直接持有并原地更新这条记录
+        record = {
             "action": action, "plan_reason": reason, "status": "start",
-            "time": datetime.datetime.now().strftime("%H:%M:%S"), "final_reason": None,
-        }
-        self.session.conversation_info.done_action.append(current_action_record)
-        action_index = len(self.session.conversation_info.done_action) - 1
-
-        handlers = {
-            "direct_reply": lambda: self._handle_reply_action("direct_reply", action_index),
-            "send_new_message": lambda: self._handle_reply_action("send_new_message", action_index),
-            "fetch_knowledge": lambda: self._handle_fetch_knowledge(reason, action_index),
-            "rethink_goal": lambda: self._handle_rethink_goal(action_index),
-            "listening": lambda: self._handle_listening(action_index),
-            "wait": lambda: self._handle_wait(action_index),
-            "say_goodbye": lambda: self._handle_say_goodbye(action_index),
-            "end_conversation": lambda: self._handle_end_conversation(action_index),
-            "block_and_ignore": lambda: self._handle_block_and_ignore(action_index),
-            "use_tool": lambda: self._handle_use_tool(reason, action_index),
+            "time": _now_hms(), "final_reason": None,
         }
-
-        handler = handlers.get(action)
-        action_successful = await handler() if handler else False
+        self.session.conversation_info.done_action.append(record)
+
+        action_successful = False
+        handler_spec = self._ACTION_HANDLERS.get(action)
+        if handler_spec:
+            method_name, extra_arg = handler_spec
+            handler = getattr(self, method_name)
+            if extra_arg is None:
+                action_successful = await handler(record)
+            else:
+                action_successful = await handler(reason if extra_arg is _PLAN_REASON else extra_arg, record)
 
         if action_successful:
-            self.session.conversation_info.done_action[action_index].update({
-                "status": "done", "time": datetime.datetime.now().strftime("%H:%M:%S"),
+            record.update({
+                "status": "done", "time": _now_hms(),
             })
             if action not in ["direct_reply", "send_new_message"]:
                 self.session.conversation_info.last_successful_reply_action = None
 
-    async def _handle_reply_action(self, action_type: str, action_index: int) -> bool:
+    async def _handle_reply_action(self, action_type: str, record: dict) -> bool:
         """处理回复类行动（支持中断）"""
-        from .replyer import ReplyGenerator, ReplyChecker
 
         max_attempts = self.config.reply_checker.max_retries
         attempt, is_suitable, need_replan, check_reason, final_reply = 0, False, False, "未进行尝试", ""
 
         replyer = ReplyGenerator(self.session, self.user_name)
         checker = ReplyChecker(self.session.stream_id, self.user_name, self.config)
+        # 重试期间目标不会变化，只需取一次
+        goal_list = self.session.conversation_info.goal_list
+        current_goal = goal_list[0].get("goal", "") if goal_list else ""
 
         while attempt < max_attempts and not is_suitable:
             # 检查是否被中断
             if self._interrupt_event.is_set():
-                logger.info(f"[PFC][{self.user_name}] 回复生成被新消息中断")
-                self.session.conversation_info.done_action[action_index].update({
+                logger.info(f"{self.log_prefix} 回复生成被新消息中断")
+                record.update({
                     "status": "recall", "final_reason": "被新消息中断"})
                 return False
             
@@ -293,44 +520,21 @@ class ConversationLoop:
             self.session.state = ConversationState.GENERATING
             
             # 使用可中断的方式生成回复
-            generate_task = asyncio.create_task(replyer.generate(action_type=action_type))
-            interrupt_task = asyncio.create_task(self._interrupt_event.wait())
-            
+            generate_task = self._spawn(
+                asyncio.wait_for(replyer.generate(action_type=action_type), self._llm_timeout))
+
             try:
-                done, pending = await asyncio.wait(
-                    [generate_task, interrupt_task],
-                    return_when=asyncio.FIRST_COMPLETED
-                )
-                
                 # 检查是否被中断
-                if self._interrupt_event.is_set():
-                    if not generate_task.done():
-                        generate_task.cancel()
-                        try:
-                            await generate_task
-                        except asyncio.CancelledError:
-                            pass
-                    for task in pending:
-                        task.cancel()
-                        try:
-                            await task
-                        except asyncio.CancelledError:
-                            pass
-                    logger.info(f"[PFC][{self.user_name}] 回复生成被新消息中断")
-                    self.session.conversation_info.done_action[action_index].update({
+                if await self._wait_interruptible(generate_task):
+                    await _cancel_and_wait(generate_task)
+                    logger.info(f"{self.log_prefix} 回复生成被新消息中断")
+                    record.update({
                         "status": "recall", "final_reason": "被新消息中断"})
                     return False
-                
+
                 reply_content = generate_task.result()
-                # 取消等待任务
-                for task in pending:
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
             except Exception as e:
-                logger.error(f"[PFC][{self.user_name}] 生成回复时出错: {e}")
+                logger.error(f"{self.log_prefix} 生成回复时出错: {e}")
                 check_reason = f"第 {attempt} 次生成出错: {e}"
                 continue
 
@@ -340,13 +544,11 @@ class ConversationLoop:
 
             self.session.state = ConversationState.CHECKING
             try:
-                current_goal = (self.session.conversation_info.goal_list[0].get("goal", "")
-                               if self.session.conversation_info.goal_list else "")
-                is_suitable, check_reason, need_replan = await checker.check(
+                is_suitable, check_reason, need_replan = await asyncio.wait_for(checker.check(
                     reply=reply_content, goal=current_goal,
                     chat_history=self.session.observation_info.chat_history,
                     chat_history_str=self.session.observation_info.chat_history_str,
-                    retry_count=attempt - 1)
+                    retry_count=attempt - 1), self._llm_timeout)
                 if is_suitable:
                     final_reply = reply_content
                     break
@@ -359,17 +561,17 @@ class ConversationLoop:
         if is_suitable:
             # 发送前再次检查是否有新消息
             if self._interrupt_event.is_set() or self._check_new_messages_after_planning():
-                self.session.conversation_info.done_action[action_index].update({
+                record.update({
                     "status": "recall", "final_reason": f"有新消息，取消发送"})
                 return False
             self.session.generated_reply = final_reply
             await self._send_reply()
             self.session.conversation_info.last_successful_reply_action = action_type
-            self.session.conversation_info.done_action[action_index].update({
+            record.update({
                 "status": "done", "final_reason": f"成功发送: {final_reply[:30]}..."})
             return True
 
-        self.session.conversation_info.done_action[action_index].update({
+        record.update({
             "status": "recall", "final_reason": f"尝试{attempt}次后失败: {check_reason}"})
         self.session.conversation_info.last_successful_reply_action = None
 
@@ -378,66 +580,64 @@ class ConversationLoop:
             await self._do_wait()
             self.session.conversation_info.done_action.append({
                 "action": "wait", "plan_reason": f"因 {action_type} 多次尝试失败而执行的后备等待",
-                "status": "done", "time": datetime.datetime.now().strftime("%H:%M:%S"), "final_reason": None})
+                "status": "done", "time": _now_hms(), "final_reason": None})
         return False
 
     async def _send_reply(self):
         """发送回复（支持多行拆分）"""
-        from src.plugin_system.apis import send_api
         reply_content = self.session.generated_reply
         if not reply_content:
             return
 
+        stream_id = self.session.stream_id
+        text_to_stream = send_api.text_to_stream
+        sent_lines: list[tuple[str, float]] = []
         try:
-            lines = [line.strip() for line in reply_content.split('\n') if line.strip()]
-            for i, line in enumerate(lines):
-                await send_api.text_to_stream(text=line, stream_id=self.session.stream_id)
-                self.session.add_bot_message(line)
-                if i < len(lines) - 1:
+            # 逐行发送，行与行之间保留 0.5 秒间隔模拟打字节奏
+            for line in filter(None, map(str.strip, reply_content.splitlines())):
+                if sent_lines:
                     await asyncio.sleep(0.5)
-            logger.info(f"[PFC][{self.user_name}] 成功发送 {len(lines)} 条回复")
+                await text_to_stream(text=line, stream_id=stream_id)
+                sent_lines.append((line, time.time()))
+            logger.info(f"{self.log_prefix} 成功发送 {len(sent_lines)} 条回复")
         except Exception as e:
-            logger.error(f"[PFC][{self.user_name}] 发送回复失败: {e}")
+            logger.error(f"{self.log_prefix} 发送回复失败: {e}")
+        finally:
+            # 已发出的行统一并入历史（发送中途失败时也保留已发送部分）
+            self.session.add_bot_messages(sent_lines)
 
-    async def _handle_fetch_knowledge(self, query: str, action_index: int) -> bool:
+    async def _handle_fetch_knowledge(self, query: str, record: dict) -> bool:
         """处理获取知识"""
         self.session.state = ConversationState.FETCHING
         try:
-            from .knowledge_fetcher import KnowledgeFetcher
-            fetcher = KnowledgeFetcher(self.user_name, self.config)
-            knowledge_text, sources_text = await fetcher.fetch(
-                query=query, chat_history=self.session.observation_info.chat_history)
+            fetcher = self._get_knowledge_fetcher()
+            knowledge_text, sources_text = await asyncio.wait_for(fetcher.fetch(
+                query=query, chat_history=self.session.observation_info.chat_history), self._llm_timeout)
 
             if knowledge_text and knowledge_text != "未找到相关知识":
-                if not hasattr(self.session.conversation_info, 'knowledge_list') or \
-                   self.session.conversation_info.knowledge_list is None:
-                    self.session.conversation_info.knowledge_list = []
                 self.session.conversation_info.knowledge_list.append({
                     "query": query[:200], "knowledge": knowledge_text,
                     "source": sources_text, "time": time.time()})
-                if len(self.session.conversation_info.knowledge_list) > 10:
-                    self.session.conversation_info.knowledge_list = \
-                        self.session.conversation_info.knowledge_list[-10:]
             return True
         except Exception as e:
-            logger.error(f"[PFC][{self.user_name}] 获取知识失败: {e}")
-            self.session.conversation_info.done_action[action_index].update({
+            logger.error(f"{self.log_prefix} 获取知识失败: {e}")
+            record.update({
                 "status": "recall", "final_reason": f"获取知识失败: {e}"})
             return False
 
-    async def _handle_rethink_goal(self, action_index: int) -> bool:
+    async def _handle_rethink_goal(self, record: dict) -> bool:
         self.session.state = ConversationState.RETHINKING
         try:
-            from .goal_analyzer import GoalAnalyzer
-            await GoalAnalyzer(self.session).analyze_goal()
+            prefetched_content = await self._consume_speculation()
+            await self._get_goal_analyzer().analyze_goal(prefetched_content=prefetched_content)
             return True
         except Exception as e:
-            logger.error(f"[PFC][{self.user_name}] 重新思考目标失败: {e}")
-            self.session.conversation_info.done_action[action_index].update({
+            logger.error(f"{self.log_prefix} 重新思考目标失败: {e}")
+            record.update({
                 "status": "recall", "final_reason": f"重新思考目标失败: {e}"})
             return False
 
-    async def _handle_listening(self, action_index: int) -> bool:
+    async def _handle_listening(self, record: dict) -> bool:
         self.session.state = ConversationState.LISTENING
         await self._do_wait_listening()
         return True
@@ -451,7 +651,7 @@ class ConversationLoop:
         waiter = Waiter(self.session.stream_id, self.user_name, self.config, new_message_checker=check_new_message)
         await waiter.wait_listening(self.session.conversation_info)
 
-    async def _handle_wait(self, action_index: int) -> bool:
+    async def _handle_wait(self, record: dict) -> bool:
         self.session.state = ConversationState.WAITING
         await self._do_wait()
         return True
@@ -465,47 +665,41 @@ class ConversationLoop:
         waiter = Waiter(self.session.stream_id, self.user_name, self.config, new_message_checker=check_new_message)
         await waiter.wait(self.session.conversation_info)
 
-    async def _handle_say_goodbye(self, action_index: int) -> bool:
-        from .replyer import ReplyGenerator
+    async def _handle_say_goodbye(self, record: dict) -> bool:
         self.session.state = ConversationState.GENERATING
         replyer = ReplyGenerator(self.session, self.user_name)
-        reply_content = await replyer.generate(action_type="say_goodbye")
+        reply_content = await asyncio.wait_for(replyer.generate(action_type="say_goodbye"), self._llm_timeout)
         if reply_content:
             self.session.generated_reply = reply_content
             await self._send_reply()
         self.session.should_continue = False
         return True
 
-    async def _handle_end_conversation(self, action_index: int) -> bool:
+    async def _handle_end_conversation(self, record: dict) -> bool:
         self.session.should_continue = False
-        logger.info(f"[PFC][{self.user_name}] 对话结束")
+        logger.info(f"{self.log_prefix} 对话结束")
         return True
 
-    async def _handle_block_and_ignore(self, action_index: int) -> bool:
+    async def _handle_block_and_ignore(self, record: dict) -> bool:
         block_seconds = self.config.waiting.block_ignore_seconds
         self.session.ignore_until_timestamp = time.time() + block_seconds
         self.session.should_continue = False
-        logger.info(f"[PFC][{self.user_name}] 已屏蔽，{block_seconds // 60}分钟内忽略")
+        logger.info(f"{self.log_prefix} 已屏蔽，{block_seconds // 60}分钟内忽略")
         return True
 
-    async def _handle_use_tool(self, reason: str, action_index: int) -> bool:
+    async def _handle_use_tool(self, reason: str, record: dict) -> bool:
         """处理使用工具行动 - 由 PFC 决策后执行工具"""
         self.session.state = ConversationState.FETCHING
         try:
-            from .context_builder import PFCContextBuilder
-            from .shared import format_chat_history
-            
             builder = PFCContextBuilder(self.session.stream_id, self.config)
             
             # 从 reason 中提取工具名称（如果有的话）
             tool_name = self._extract_tool_name_from_reason(reason)
             
             # 构建聊天历史
-            from .shared import PersonalityHelper
-            personality_helper = PersonalityHelper(self.user_name)
             chat_history_text = format_chat_history(
                 self.session.observation_info.chat_history,
-                personality_helper.bot_name,
+                self._personality_helper.bot_name,
                 self.user_name,
                 10
             )
@@ -528,11 +722,7 @@ class ConversationLoop:
                 used_tools = result.get("used_tools", [])
                 tool_results = result.get("results", [result.get("result")])
                 
-                # 记录工具执行结果到会话
-                if not hasattr(self.session.conversation_info, 'tool_results') or \
-                   self.session.conversation_info.tool_results is None:
-                    self.session.conversation_info.tool_results = []
-                
+                # 记录工具执行结果到会话（tool_results 由 ConversationInfo 保证始终存在）
                 for tool_result in tool_results:
                     if tool_result:
                         self.session.conversation_info.tool_results.append({
@@ -541,29 +731,24 @@ class ConversationLoop:
                             "time": time.time()
                         })
                 
-                # 保留最近10条工具结果
-                if len(self.session.conversation_info.tool_results) > 10:
-                    self.session.conversation_info.tool_results = \
-                        self.session.conversation_info.tool_results[-10:]
-                
-                logger.info(f"[PFC][{self.user_name}] 工具执行成功: {used_tools}")
-                self.session.conversation_info.done_action[action_index].update({
+                logger.info(f"{self.log_prefix} 工具执行成功: {used_tools}")
+                record.update({
                     "status": "done",
                     "final_reason": f"成功执行工具: {', '.join(used_tools) if used_tools else tool_name}"
                 })
                 return True
             else:
                 error_msg = result.get("error", "未知错误")
-                logger.warning(f"[PFC][{self.user_name}] 工具执行失败: {error_msg}")
-                self.session.conversation_info.done_action[action_index].update({
+                logger.warning(f"{self.log_prefix} 工具执行失败: {error_msg}")
+                record.update({
                     "status": "recall",
                     "final_reason": f"工具执行失败: {error_msg}"
                 })
                 return False
                 
         except Exception as e:
-            logger.error(f"[PFC][{self.user_name}] 使用工具失败: {e}")
-            self.session.conversation_info.done_action[action_index].update({
+            logger.error(f"{self.log_prefix} 使用工具失败: {e}")
+            record.update({
                 "status": "recall",
                 "final_reason": f"使用工具失败: {e}"
             })
@@ -571,19 +756,8 @@ class ConversationLoop:
 
     def _extract_tool_name_from_reason(self, reason: str) -> str:
         """从 reason 中提取工具名称"""
-        import re
-        
-        # 尝试匹配常见的工具名称模式
-        patterns = [
-            r'使用\s*[「"\'`]?(\w+)[」"\'`]?\s*工具',
-            r'调用\s*[「"\'`]?(\w+)[」"\'`]?',
-            r'工具[：:]\s*[「"\'`]?(\w+)[」"\'`]?',
-            r'tool[：:]\s*[「"\'`]?(\w+)[」"\'`]?',
-            r'(\w+_\w+)',  # 匹配下划线分隔的工具名
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, reason, re.IGNORECASE)
+        for pattern in _TOOL_NAME_PATTERNS:
+            match = pattern.search(reason)
             if match:
                 return match.group(1)
         
@@ -592,23 +766,25 @@ class ConversationLoop:
 
 class ConversationLoopManager:
     """会话循环管理器"""
-    _instance: Optional["ConversationLoopManager"] = None
 
     def __init__(self):
         self._loops: Dict[str, ConversationLoop] = {}
         self._lock = asyncio.Lock()
 
-    @classmethod
-    def get_instance(cls) -> "ConversationLoopManager":
-        if cls._instance is None:
-            cls._instance = ConversationLoopManager()
-        return cls._instance
-
     async def get_or_create_loop(self, session: PFCSession, user_name: str) -> ConversationLoop:
+        user_id = session.user_id
+        # 快速路径：循环已存在且在运行时无需加锁（字典读取在单个事件循环内是原子的）
+        loop = self._loops.get(user_id)
+        if loop is not None and loop._running:
+            if loop.user_name != user_name:
+                loop.user_name = user_name
+                loop.log_prefix = f"[PFC][{user_name}]"
+            return loop
+
         async with self._lock:
-            user_id = session.user_id
-            if user_id in self._loops:
-                loop = self._loops[user_id]
+            # 加锁后再次检查，避免并发创建重复循环
+            loop = self._loops.get(user_id)
+            if loop is not None:
                 if loop._running:
                     return loop
                 del self._loops[user_id]
@@ -631,5 +807,8 @@ class ConversationLoopManager:
             self._loops.clear()
 
 
+_loop_manager = ConversationLoopManager()
+
+
 def get_loop_manager() -> ConversationLoopManager:
-    return ConversationLoopManager.get_instance()
\ No newline at end of file
+    return _loop_manager
@@ -17,11 +17,39 @@ PFC - 数据库模型
 
 import time
 
-from sqlalchemy import Boolean, Float, Index, Integer, Text
+from sqlalchemy import Boolean, Float, Index, Integer, Text, text
 from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.types import TypeDecorator
 
 from src.common.database.core.models import Base, get_string_field
 
+from .shared import json_dumps, json_loads
+
+
+class JSONText(TypeDecorator):
+    """以 TEXT 存储的 JSON 字段
+    
+    写入时自动序列化（已是字符串则原样写入），读取时直接返回 dict，
+    内容损坏或顶层不是对象时返回空字典。底层仍为 TEXT，已有数据无需迁移。
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return json_dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if not value:
+            return {}
+        try:
+            data = json_loads(value)
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
 
 class PFCSession(Base):
     """PFC 会话模型
@@ -43,10 +71,10 @@ class PFCSession(Base):
     ignore_until_timestamp: Mapped[float | None] = mapped_column(Float, nullable=True)
     
     # 对话信息 (JSON 格式存储)
-    conversation_info_json: Mapped[str] = mapped_column(Text, nullable=False, default="{}")
+    conversation_info_json: Mapped[dict] = mapped_column(JSONText, nullable=False, default=dict)
     
     # 观察信息 (JSON 格式存储)
-    observation_info_json: Mapped[str] = mapped_column(Text, nullable=False, default="{}")
+    observation_info_json: Mapped[dict] = mapped_column(JSONText, nullable=False, default=dict)
     
     # 等待配置
     waiting_max_seconds: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
@@ -86,7 +114,7 @@ class PFCChatHistory(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     
     # 关联信息
-    user_id: Mapped[str] = mapped_column(get_string_field(100), nullable=False, index=True)
+    user_id: Mapped[str] = mapped_column(get_string_field(100), nullable=False)
     
     # 消息信息
     message_type: Mapped[str] = mapped_column(get_string_field(50), nullable=False)  # user_message, bot_message
@@ -99,7 +127,13 @@ class PFCChatHistory(Base):
     created_at: Mapped[float] = mapped_column(Float, nullable=False, default=time.time)
 
     __table_args__ = (
-        Index("idx_pfc_history_user_id", "user_id"),
         Index("idx_pfc_history_time", "message_time"),
-        Index("idx_pfc_history_user_time", "user_id", "message_time"),
+        # 热点查询为"某用户最近 N 条消息"（ORDER BY message_time DESC LIMIT N），使用降序索引避免反向扫描/排序；
+        # 该索引以 user_id 开头，同时覆盖按 user_id 过滤的查询。PostgreSQL 下附带 id，裁剪子查询可只读索引
+        Index(
+            "idx_pfc_history_user_time_desc",
+            "user_id",
+            text("message_time DESC"),
+            postgresql_include=["id"],
+        ),
     )
\ No newline at end of file
@@ -18,11 +18,16 @@ PFC - 数据库存储后端
 会在数据库迁移时自动创建表。
 """
 
-import json
+import asyncio
+import contextlib
+import copy
+import hashlib
 import time
 from typing import TYPE_CHECKING
 
-from sqlalchemy import delete, select
+from sqlalchemy import Row, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from src.common.database.api.crud import CRUDBase
 from src.common.database.core.session import get_db_session
@@ -30,6 +35,8 @@ from src.common.logger import get_logger
 
 # 导入 PFC 数据库模型（这会将它们注册到 Base.metadata）
 from .db_models import PFCChatHistory, PFCSession as PFCSessionModel
+from .models import dumps_model
+from .shared import TTLCache, json_dumps
 
 if TYPE_CHECKING:
     from .session import PFCSession
@@ -37,6 +44,42 @@ if TYPE_CHECKING:
 logger = get_logger("pfc_db_storage")
 
 
+# 支持 ON CONFLICT upsert 的方言
+_UPSERT_INSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": pg_insert,
+}
+
+
+def _session_fingerprint(session_data: dict) -> bytes:
+    """计算会话行数据的指纹，用于判断自上次保存后是否有变化"""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in session_data.values():
+        digest.update(value.encode() if isinstance(value, str) else repr(value).encode())
+        digest.update(b"\x00")
+    return digest.digest()
+
+
+# 构建会话内存消息所需的聊天历史列
+_MESSAGE_COLUMNS = (
+    PFCChatHistory.message_type,
+    PFCChatHistory.content,
+    PFCChatHistory.message_time,
+    PFCChatHistory.sender_name,
+    PFCChatHistory.sender_id,
+)
+
+
+def _history_record_to_message(record: Row) -> dict:
+    """将一条聊天历史记录转换为会话内存中的消息格式（空的发送者字段不写入）"""
+    msg = {"type": record.message_type, "content": record.content, "time": record.message_time}
+    if record.sender_name:
+        msg["user_name"] = record.sender_name
+    if record.sender_id:
+        msg["user_id"] = record.sender_id
+    return msg
+
+
 class PFCSessionCRUD(CRUDBase[PFCSessionModel]):
     """PFC 会话 CRUD 操作"""
 
@@ -51,6 +94,44 @@ class PFCSessionCRUD(CRUDBase[PFCSessionModel]):
         """获取所有等待状态的会话"""
         return await self.get_multi(state="waiting", limit=1000, use_cache=False)
 
+    async def upsert_by_user_id(self, data: dict) -> int:
+        """按 user_id 插入或更新会话（单条语句，无先查后写的竞态）
+        
+        SQLite / PostgreSQL 使用 INSERT ... ON CONFLICT DO UPDATE ... RETURNING，
+        其他数据库回退到同一事务内的查询 + 更新/插入。
+        
+        Returns:
+            会话行的主键
+        """
+        async with get_db_session() as session:
+            dialect = session.get_bind().dialect.name
+            dialect_insert = _UPSERT_INSERTS.get(dialect)
+            if dialect_insert is not None:
+                stmt = dialect_insert(PFCSessionModel).values(**data)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[PFCSessionModel.user_id],
+                    set_={key: stmt.excluded[key] for key in data if key != "user_id"},
+                ).returning(PFCSessionModel.id)
+                return (await session.execute(stmt)).scalar_one()
+
+            existing_id = (await session.execute(
+                select(PFCSessionModel.id).where(PFCSessionModel.user_id == data["user_id"])
+            )).scalar_one_or_none()
+            if existing_id is None:
+                result = await session.execute(insert(PFCSessionModel).values(**data))
+                return result.inserted_primary_key[0]
+            await session.execute(
+                update(PFCSessionModel).where(PFCSessionModel.id == existing_id).values(**data)
+            )
+            return existing_id
+
+    async def update_by_pk(self, pk: int, data: dict) -> bool:
+        """按主键更新会话，返回是否有行被更新（行已被删除时为 False）"""
+        async with get_db_session() as session:
+            stmt = update(PFCSessionModel).where(PFCSessionModel.id == pk).values(**data)
+            result = await session.execute(stmt)
+            return result.rowcount > 0  # type: ignore
+
     async def delete_by_user_id(self, user_id: str) -> bool:
         """根据用户 ID 删除会话"""
         async with get_db_session() as session:
@@ -69,39 +150,125 @@ class PFCChatHistoryCRUD(CRUDBase[PFCChatHistory]):
         self,
         user_id: str,
         limit: int = 100,
-    ) -> list[PFCChatHistory]:
-        """获取用户的聊天历史"""
+    ) -> list[Row]:
+        """获取用户的聊天历史
+        
+        只查询构建消息所需的列，返回轻量的 Row（可按列名访问），不构建 ORM 实例。
+        """
         async with get_db_session() as session:
-            stmt = (
-                select(PFCChatHistory)
+            # 内层按时间倒序取最近 limit 条，外层再按正序返回，使最早的消息在前
+            recent = (
+                select(*_MESSAGE_COLUMNS)
                 .where(PFCChatHistory.user_id == user_id)
                 .order_by(PFCChatHistory.message_time.desc())
                 .limit(limit)
+                .subquery()
             )
+            stmt = select(recent).order_by(recent.c.message_time.asc())
             result = await session.execute(stmt)
-            # 返回时反转顺序，使最早的消息在前
-            return list(reversed(result.scalars().all()))
+            return list(result.all())
 
-    async def add_message(
+    async def get_history_by_users(
         self,
+        user_ids: list[str],
+        limit: int = 100,
+    ) -> dict[str, list[Row]]:
+        """批量获取多个用户的聊天历史（单次 IN 查询）
+        
+        Returns:
+            user_id -> 按时间正序排列的最近 limit 条消息
+        """
+        grouped: dict[str, list[Row]] = {user_id: [] for user_id in user_ids}
+        if not user_ids:
+            return grouped
+        async with get_db_session() as session:
+            stmt = (
+                select(PFCChatHistory.user_id, *_MESSAGE_COLUMNS)
+                .where(PFCChatHistory.user_id.in_(user_ids))
+                .order_by(PFCChatHistory.user_id, PFCChatHistory.message_time)
+            )
+            result = await session.execute(stmt)
+            for record in result:
+                grouped[record.user_id].append(record)
+        # 历史在保存时已裁剪，这里仅兜底截取最近 limit 条
+        for user_id, records in grouped.items():
+            if len(records) > limit:
+                grouped[user_id] = records[-limit:]
+        return grouped
+
+    @staticmethod
+    def build_row(
         user_id: str,
         message_type: str,
         content: str,
         sender_name: str | None = None,
         sender_id: str | None = None,
         message_time: float | None = None,
-    ) -> PFCChatHistory:
-        """添加聊天消息"""
-        msg_time = message_time or time.time()
-        return await self.create({
+    ) -> dict:
+        """构建一行聊天历史数据"""
+        return {
             "user_id": user_id,
             "message_type": message_type,
             "content": content,
             "sender_name": sender_name,
             "sender_id": sender_id,
-            "message_time": msg_time,
+            "message_time": message_time or time.time(),
             "created_at": time.time(),
-        })
+        }
+
+    async def add_message(
+        self,
+        user_id: str,
+        message_type: str,
+        content: str,
+        sender_name: str | None = None,
+        sender_id: str | None = None,
+        message_time: float | None = None,
+    ) -> PFCChatHistory:
+        """添加聊天消息"""
+        return await self.create(
+            self.build_row(user_id, message_type, content, sender_name, sender_id, message_time)
+        )
+
+    async def sync_history(
+        self,
+        user_id: str,
+        messages: list[dict],
+        max_count: int = 100,
+    ) -> int:
+        """增量同步聊天历史
+        
+        在同一事务内完成：查询已保存的最新消息时间、批量插入更新的消息、裁剪历史。
+        
+        Args:
+            user_id: 用户 ID
+            messages: 会话中的聊天历史（内存格式）
+            max_count: 保留的最大消息条数
+        
+        Returns:
+            新插入的消息条数
+        """
+        async with get_db_session() as session:
+            latest = await session.scalar(
+                select(func.max(PFCChatHistory.message_time)).where(PFCChatHistory.user_id == user_id)
+            ) or 0.0
+            build_row = self.build_row
+            rows = [
+                build_row(
+                    user_id=user_id,
+                    message_type=msg.get("type", "unknown"),
+                    content=msg.get("content", ""),
+                    sender_name=msg.get("user_name"),
+                    sender_id=msg.get("user_id"),
+                    message_time=msg_time,
+                )
+                for msg in messages
+                if (msg_time := msg.get("time", 0)) > latest
+            ]
+            if rows:
+                await session.execute(insert(PFCChatHistory), rows)
+                await self._trim(session, user_id, max_count)
+            return len(rows)
 
     async def clear_history(self, user_id: str) -> int:
         """清除用户的聊天历史"""
@@ -113,26 +280,30 @@ class PFCChatHistoryCRUD(CRUDBase[PFCChatHistory]):
     async def trim_history(self, user_id: str, max_count: int = 100) -> int:
         """裁剪用户的聊天历史，保留最近的 max_count 条"""
         async with get_db_session() as session:
-            # 获取需要保留的消息的最小 ID
-            subquery = (
-                select(PFCChatHistory.id)
-                .where(PFCChatHistory.user_id == user_id)
-                .order_by(PFCChatHistory.message_time.desc())
-                .limit(max_count)
-            )
-            result = await session.execute(subquery)
-            keep_ids = [row[0] for row in result.fetchall()]
-
-            if not keep_ids:
-                return 0
+            return await self._trim(session, user_id, max_count)
+
+    @staticmethod
+    async def _trim(session, user_id: str, max_count: int) -> int:
+        """在给定数据库会话内裁剪聊天历史"""
+        # 需要保留的最近 max_count 条消息，作为子查询直接在数据库端求值；
+        # MySQL 不支持 IN 子查询中的 LIMIT，也不允许 DELETE 的子查询直接引用目标表，
+        # 因此包一层派生表：SELECT id FROM (SELECT id ... LIMIT n) AS keep
+        recent = (
+            select(PFCChatHistory.id)
+            .where(PFCChatHistory.user_id == user_id)
+            .order_by(PFCChatHistory.message_time.desc())
+            .limit(max_count)
+            .subquery("keep")
+        )
+        keep_ids = select(recent.c.id)
 
-            # 删除不在保留列表中的消息
-            stmt = delete(PFCChatHistory).where(
-                PFCChatHistory.user_id == user_id,
-                PFCChatHistory.id.notin_(keep_ids),
-            )
-            result = await session.execute(stmt)
-            return result.rowcount  # type: ignore
+        # 删除不在保留列表中的消息
+        stmt = delete(PFCChatHistory).where(
+            PFCChatHistory.user_id == user_id,
+            PFCChatHistory.id.notin_(keep_ids),
+        )
+        result = await session.execute(stmt)
+        return result.rowcount  # type: ignore
 
 
 class DatabaseSessionStorage:
@@ -141,41 +312,53 @@ class DatabaseSessionStorage:
     提供与 JSON 文件存储相同的接口，但使用数据库作为后端。
     """
 
+    CACHE_TTL_SECONDS = 5.0
+
     def __init__(self):
         self._session_crud = PFCSessionCRUD()
         self._history_crud = PFCChatHistoryCRUD()
+        # 已加载会话的短期缓存，保存/删除时失效；命中时返回深拷贝，调用方可随意修改
+        self._cache = TTLCache(maxsize=256, ttl=self.CACHE_TTL_SECONDS)
+        # 写回队列：user_id -> 最新待写快照，由后台任务合并落库
+        self._pending: dict[str, tuple["PFCSession", dict, list[dict]]] = {}
+        self._wake = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._writer_task: asyncio.Task | None = None
 
     async def load_session(self, user_id: str) -> dict | None:
         """从数据库加载会话数据"""
-        db_session = await self._session_crud.get_by_user_id(user_id)
+        # 该用户还有未落库（或正在写入）的快照时先落库，保证读到最新状态
+        if user_id in self._pending or self._write_lock.locked():
+            await self.flush()
+
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        # 会话行与聊天历史互不依赖，并发查询（各自使用独立的连接）
+        db_session, history_records = await asyncio.gather(
+            self._session_crud.get_by_user_id(user_id),
+            self._history_crud.get_history_by_user(user_id),
+        )
         if db_session is None:
             return None
 
+        data = self._session_row_to_dict(db_session, history_records)
+        self._cache.set(user_id, data)
+        return copy.deepcopy(data)
+
+    @staticmethod
+    def _session_row_to_dict(
+        db_session: PFCSessionModel,
+        history_records: list[Row],
+    ) -> dict:
+        """将会话行与其聊天历史记录转换为会话字典"""
         # 转换为字典格式
-        try:
-            conversation_info = json.loads(db_session.conversation_info_json or "{}")
-        except json.JSONDecodeError:
-            conversation_info = {}
+        # JSON 字段读取时已由 JSONText 解析为 dict
+        conversation_info = db_session.conversation_info_json
+        observation_info = db_session.observation_info_json
 
-        try:
-            observation_info = json.loads(db_session.observation_info_json or "{}")
-        except json.JSONDecodeError:
-            observation_info = {}
-
-        # 从数据库加载聊天历史
-        history_records = await self._history_crud.get_history_by_user(user_id)
-        chat_history = []
-        for record in history_records:
-            msg_dict = {
-                "type": record.message_type,
-                "content": record.content,
-                "time": record.message_time,
-            }
-            if record.sender_name:
-                msg_dict["user_name"] = record.sender_name
-            if record.sender_id:
-                msg_dict["user_id"] = record.sender_id
-            chat_history.append(msg_dict)
+        chat_history = [_history_record_to_message(record) for record in history_records]
 
         # 更新 observation_info 中的聊天历史
         observation_info["chat_history"] = chat_history
@@ -202,99 +385,143 @@ class DatabaseSessionStorage:
         }
 
     async def save_session(self, session: "PFCSession") -> bool:
-        """保存会话到数据库"""
+        """保存会话到数据库（写回队列）
+        
+        在调用时生成快照并放入待写队列后立即返回；同一用户的多次保存会合并为最新的一次，
+        由后台写入任务批量落库。需要确保已落库时调用 flush()。
+        """
         try:
-            # 准备数据
-            conversation_info_json = json.dumps(
-                session.conversation_info.to_dict(),
-                ensure_ascii=False,
-            )
-
-            # 观察信息不包含聊天历史（聊天历史单独存储）
-            obs_dict = session.observation_info.to_dict()
-            obs_dict.pop("chat_history", None)
-            obs_dict.pop("chat_history_str", None)
-            observation_info_json = json.dumps(obs_dict, ensure_ascii=False)
-
-            session_data = {
-                "user_id": session.user_id,
-                "stream_id": session.stream_id,
-                "state": str(session.state),
-                "should_continue": session.should_continue,
-                "ignore_until_timestamp": session.ignore_until_timestamp,
-                "conversation_info_json": conversation_info_json,
-                "observation_info_json": observation_info_json,
-                "waiting_max_seconds": session.waiting_config.max_wait_seconds,
-                "waiting_started_at": session.waiting_config.started_at,
-                "created_at": session.created_at,
-                "last_activity_at": session.last_activity_at,
-                "total_interactions": session.total_interactions,
-                "last_proactive_at": session.last_proactive_at,
-                "consecutive_timeout_count": session.consecutive_timeout_count,
-                "last_user_message_at": session.last_user_message_at,
-            }
-
-            # 检查是否存在
-            existing = await self._session_crud.get_by_user_id(session.user_id)
-            if existing:
-                # 更新
-                await self._session_crud.update(existing.id, session_data)
-            else:
-                # 创建
-                await self._session_crud.create(session_data)
-
-            # 保存聊天历史（增量保存）
-            await self._save_chat_history(session)
+            self._pending[session.user_id] = self._snapshot(session)
+        except Exception as e:
+            logger.error(f"生成会话快照失败 {session.user_id}: {e}")
+            return False
+        self._cache.pop(session.user_id)
+        self._ensure_writer()
+        self._wake.set()
+        return True
+
+    def _snapshot(self, session: "PFCSession") -> tuple["PFCSession", dict, list[dict]]:
+        """生成会话的待写快照：(会话对象, 会话行数据, 聊天历史副本)"""
+        # 在此处序列化，以便计算指纹；JSONText 会原样写入字符串
+        conversation_info_json = dumps_model(session.conversation_info)
+
+        # 观察信息不包含聊天历史（聊天历史单独存储）
+        obs_dict = session.observation_info.to_dict()
+        obs_dict.pop("chat_history", None)
+        obs_dict.pop("chat_history_str", None)
+        observation_info_json = json_dumps(obs_dict)
+
+        session_data = {
+            "user_id": session.user_id,
+            "stream_id": session.stream_id,
+            "state": str(session.state),
+            "should_continue": session.should_continue,
+            "ignore_until_timestamp": session.ignore_until_timestamp,
+            "conversation_info_json": conversation_info_json,
+            "observation_info_json": observation_info_json,
+            "waiting_max_seconds": session.waiting_config.max_wait_seconds,
+            "waiting_started_at": session.waiting_config.started_at,
+            "created_at": session.created_at,
+            "last_activity_at": session.last_activity_at,
+            "total_interactions": session.total_interactions,
+            "last_proactive_at": session.last_proactive_at,
+            "consecutive_timeout_count": session.consecutive_timeout_count,
+            "last_user_message_at": session.last_user_message_at,
+        }
+        return session, session_data, list(session.observation_info.chat_history)
+
+    def _ensure_writer(self) -> None:
+        """按需启动后台写入任务"""
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def _writer_loop(self) -> None:
+        """后台写入任务：被唤醒后将待写队列整体落库"""
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            async with self._write_lock:
+                await self._drain()
+
+    async def _drain(self) -> None:
+        """写入当前所有待写快照（调用方需持有 _write_lock）"""
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            for session, session_data, chat_history in batch.values():
+                await self._write(session, session_data, chat_history)
+
+    async def flush(self) -> None:
+        """等待所有待写快照落库"""
+        async with self._write_lock:
+            await self._drain()
+
+    async def close(self) -> None:
+        """落库剩余快照并停止后台写入任务"""
+        await self.flush()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._writer_task
+            self._writer_task = None
+
+    async def _write(self, session: "PFCSession", session_data: dict, chat_history: list[dict]) -> bool:
+        """将一份会话快照写入数据库"""
+        try:
+            # 与上次成功保存的内容完全一致时跳过会话行的写入
+            fingerprint = _session_fingerprint(session_data)
+            if fingerprint != session._last_save_fp:
+                # 已知主键时直接按主键更新；首次保存或行已不存在时走 upsert 并记下主键
+                if session._db_pk is None or not await self._session_crud.update_by_pk(
+                    session._db_pk, session_data
+                ):
+                    session._db_pk = await self._session_crud.upsert_by_user_id(session_data)
+                session._last_save_fp = fingerprint
+
+            # 保存聊天历史（增量保存，自带按时间去重）
+            await self._save_chat_history(session.user_id, chat_history)
 
             return True
         except Exception as e:
             logger.error(f"保存会话到数据库失败 {session.user_id}: {e}")
             return False
+        finally:
+            # 写入完成（或失败）后使缓存失效，保证下次加载读到数据库中的最新状态
+            self._cache.pop(session.user_id)
 
-    async def _save_chat_history(self, session: "PFCSession") -> None:
+    async def _save_chat_history(self, user_id: str, chat_history: list[dict]) -> None:
         """保存聊天历史到数据库"""
-        # 获取数据库中已有的最新消息时间
-        existing_history = await self._history_crud.get_history_by_user(
-            session.user_id, limit=1
-        )
-        last_saved_time = 0.0
-        if existing_history:
-            last_saved_time = existing_history[-1].message_time
-
-        # 只保存新消息
-        for msg in session.observation_info.chat_history:
-            msg_time = msg.get("time", 0)
-            if msg_time > last_saved_time:
-                await self._history_crud.add_message(
-                    user_id=session.user_id,
-                    message_type=msg.get("type", "unknown"),
-                    content=msg.get("content", ""),
-                    sender_name=msg.get("user_name"),
-                    sender_id=msg.get("user_id"),
-                    message_time=msg_time,
-                )
-
-        # 裁剪历史
-        await self._history_crud.trim_history(session.user_id, max_count=100)
+        # 只保存新消息；最新时间查询、批量插入与裁剪共用一个连接和事务
+        await self._history_crud.sync_history(user_id, chat_history, max_count=100)
 
     async def delete_session(self, user_id: str) -> bool:
         """删除会话"""
-        try:
-            await self._session_crud.delete_by_user_id(user_id)
-            await self._history_crud.clear_history(user_id)
-            return True
-        except Exception as e:
-            logger.error(f"删除会话失败 {user_id}: {e}")
-            return False
+        # 持有写入锁：等待进行中的写入结束，并丢弃尚未写入的快照，避免删除后又被写回
+        async with self._write_lock:
+            self._pending.pop(user_id, None)
+            self._cache.pop(user_id)
+            try:
+                await self._session_crud.delete_by_user_id(user_id)
+                await self._history_crud.clear_history(user_id)
+                return True
+            except Exception as e:
+                logger.error(f"删除会话失败 {user_id}: {e}")
+                return False
 
     async def get_waiting_sessions_data(self) -> list[dict]:
         """获取所有等待状态的会话数据"""
+        await self.flush()
         db_sessions = await self._session_crud.get_waiting_sessions()
+        if not db_sessions:
+            return []
+        # 一次性取回所有等待会话的聊天历史，避免逐个会话查询（N+1）
+        histories = await self._history_crud.get_history_by_users(
+            [db_session.user_id for db_session in db_sessions]
+        )
         result = []
         for db_session in db_sessions:
-            data = await self.load_session(db_session.user_id)
-            if data:
-                result.append(data)
+            data = self._session_row_to_dict(db_session, histories[db_session.user_id])
+            self._cache.set(db_session.user_id, data)
+            result.append(copy.deepcopy(data))
         return result
 
 
@@ -307,4 +534,10 @@ def get_db_storage() -> DatabaseSessionStorage:
     global _db_storage
     if _db_storage is None:
         _db_storage = DatabaseSessionStorage()
-    return _db_storage
\ No newline at end of file
+    return _db_storage
+
+
+async def close_db_storage() -> None:
+    """落库所有待写会话并停止后台写入任务（插件卸载时调用）"""
+    if _db_storage is not None:
+        await _db_storage.close()
\ No newline at end of file
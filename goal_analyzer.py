@@ -26,6 +26,7 @@ PFC目标分析器模块
 负责分析对话历史并设定/更新对话目标
 """
 
+import hashlib
 from typing import List, Tuple, Optional, Dict, Any
 from src.common.logger import get_logger
 from src.plugin_system.apis import llm_api
@@ -34,10 +35,13 @@ from src.config.config import global_config
 from .models import ObservationInfo, ConversationInfo
 from .shared import (
     PersonalityHelper,
+    PromptTemplate,
+    TTLCache,
     get_current_time_str,
     build_goals_string,
     extract_json_from_text,
     extract_json_array_from_text,
+    to_bool,
 )
 
 logger = get_logger("PFC-GoalAnalyzer")
@@ -45,18 +49,11 @@ logger = get_logger("PFC-GoalAnalyzer")
 
 # ============== Prompt 模板 ==============
 
-PROMPT_ANALYZE_GOAL = """{persona_text}。现在你在参与一场QQ聊天，请分析以下聊天记录，并根据你的性格特征确定多个明确的对话目标。
-这些目标应该反映出对话的不同方面和意图。
-
-【当前时间】
-{current_time_str}
-
-{action_history_text}
-当前对话目标：
-{goals_str}
+# 提示词按"静态前缀 + 动态尾部"组织：人格、任务说明与输出示例在前且不随对话变化，
+# 时间、目标与聊天记录等每轮变化的内容统一放在末尾，使服务端提示词缓存能够命中前缀
 
-聊天记录：
-{chat_history_text}
+PROMPT_ANALYZE_GOAL_STATIC = """{persona_text}。现在你在参与一场QQ聊天，请分析下方的聊天记录，并根据你的性格特征确定多个明确的对话目标。
+这些目标应该反映出对话的不同方面和意图。
 
 请分析当前对话并确定最适合的对话目标。你可以：
 1. 保持现有目标不变
@@ -79,19 +76,24 @@ PROMPT_ANALYZE_GOAL = """{persona_text}。现在你在参与一场QQ聊天，请
     "goal": "回答用户关于python安装的具体问题",
     "reasoning": "用户提出了关于Python的技术问题，需要专业且准确的解答"
 }}
-]"""
-
-PROMPT_ANALYZE_CONVERSATION = """{persona_text}。现在你在参与一场QQ聊天，
+]
+"""
 
+PROMPT_ANALYZE_GOAL_DYNAMIC = """
 【当前时间】
 {current_time_str}
 
-当前对话目标：{goal}
-产生该对话目标的原因：{reasoning}
+{action_history_text}
+当前对话目标：
+{goals_str}
 
-请分析以下聊天记录，并根据你的性格特征评估该目标是否已经达到，或者你是否希望停止该次对话。
 聊天记录：
-{chat_history_text}
+{chat_history_text}"""
+
+PROMPT_ANALYZE_GOAL = PROMPT_ANALYZE_GOAL_STATIC + PROMPT_ANALYZE_GOAL_DYNAMIC
+
+PROMPT_ANALYZE_CONVERSATION_STATIC = """{persona_text}。现在你在参与一场QQ聊天，
+请根据下方给出的对话目标与聊天记录，结合你的性格特征评估该目标是否已经达到，或者你是否希望停止该次对话。
 请以JSON格式输出，包含以下字段：
 1. goal_achieved: 对话目标是否已经达到（true/false）
 2. stop_conversation: 是否希望停止该次对话（true/false）
@@ -102,7 +104,30 @@ PROMPT_ANALYZE_CONVERSATION = """{persona_text}。现在你在参与一场QQ聊
     "goal_achieved": true,
     "stop_conversation": false,
     "reason": "虽然目标已达成，但对话仍然有继续的价值"
-}}"""
+}}
+"""
+
+PROMPT_ANALYZE_CONVERSATION_DYNAMIC = """
+【当前时间】
+{current_time_str}
+
+当前对话目标：{goal}
+产生该对话目标的原因：{reasoning}
+
+聊天记录：
+{chat_history_text}"""
+
+PROMPT_ANALYZE_CONVERSATION = PROMPT_ANALYZE_CONVERSATION_STATIC + PROMPT_ANALYZE_CONVERSATION_DYNAMIC
+
+# 模板只在导入时解析一次
+_GOAL_TEMPLATE = PromptTemplate(PROMPT_ANALYZE_GOAL)
+_CONVERSATION_TEMPLATE = PromptTemplate(PROMPT_ANALYZE_CONVERSATION)
+
+# 消息缺少 sender 字段时使用的只读空字典
+_EMPTY: Dict[str, Any] = {}
+
+# LLM 响应缓存：提示词完全相同时直接复用上次的成功响应（跨会话共享）
+_llm_response_cache = TTLCache(maxsize=512, ttl=300.0)
 
 
 def _calculate_similarity(goal1: str, goal2: str) -> float:
@@ -158,17 +183,78 @@ class GoalAnalyzer:
         self.goals: List[Tuple[str, str, str]] = []  # (goal, method, reasoning)
         self.max_goals = 3  # 同时保持的最大目标数量
         self.current_goal_and_reason = None
+        self._planner_config = None  # 规划模型配置，首次请求时获取
+        self._persona_text: Optional[str] = None  # 对话分析用的人设文本，首次分析时构建
+        # 上次构建的聊天历史文本：(chat_history_str, 新消息数, 未处理消息数, 最后一条未处理消息, 结果)
+        self._history_text_cache: Optional[tuple] = None
+        # 未处理消息的渲染缓存：(已渲染条数, 首条消息, 末条消息, 渲染文本)，消息只追加时仅渲染新增部分
+        self._format_cache: Optional[tuple] = None
         
         logger.debug("[PFC]目标分析器初始化完成")
     
-    async def analyze_goal(self) -> Tuple[str, str, str]:
+    async def analyze_goal(self, prefetched_content: Optional[str] = None) -> Tuple[str, str, str]:
         """
         分析对话历史并设定目标
+        
+        Args:
+            prefetched_content: 预先取得的 LLM 响应（推测执行的结果），为空时现场请求
             
         Returns:
             (目标, 方法, 原因) 元组
         """
         conversation_info = self.session.conversation_info
+        
+        content = prefetched_content or await self.generate_goal_response()
+        if not content:
+            return "", "", ""
+        
+        # 解析JSON响应
+        result = self._parse_goal_response(content, conversation_info)
+        
+        return result
+    
+    def invalidate_persona(self) -> None:
+        """人格配置热重载后调用，下次分析时重新加载人格信息"""
+        self._personality_helper.invalidate()
+        self._persona_text = None
+
+    def _get_planner_config(self):
+        """获取规划用的模型配置（planner 优先，其次 normal），获取成功后复用"""
+        if self._planner_config is None:
+            models = llm_api.get_available_models()
+            self._planner_config = models.get("planner") or models.get("normal")
+        return self._planner_config
+
+    async def _generate_cached(self, prompt: str, model_config, request_type: str) -> Tuple[bool, str]:
+        """
+        调用 LLM 生成内容，提示词完全相同时复用缓存的成功响应
+        
+        Returns:
+            (success, content) 元组
+        """
+        key = (request_type, hashlib.blake2b(prompt.encode(), digest_size=16).digest())
+        cached = _llm_response_cache.get(key)
+        if cached is not None:
+            logger.debug(f"[PFC]命中 LLM 响应缓存: {request_type}")
+            return True, cached
+        
+        success, content, _, _ = await llm_api.generate_with_model(
+            prompt=prompt,
+            model_config=model_config,
+            request_type=request_type,
+        )
+        if success and content:
+            _llm_response_cache.set(key, content)
+        return success, content
+
+    async def generate_goal_response(self) -> str:
+        """
+        请求 LLM 分析对话目标，只返回原始响应，不修改会话状态
+        
+        Returns:
+            LLM 响应内容，失败时返回空字符串
+        """
+        conversation_info = self.session.conversation_info
         observation_info = self.session.observation_info
         
         logger.debug("[PFC]开始分析对话目标...")
@@ -180,37 +266,30 @@ class GoalAnalyzer:
         )
         
         # 格式化Prompt
-        prompt = PROMPT_ANALYZE_GOAL.format(**prompt_params)
+        prompt = _GOAL_TEMPLATE.format(**prompt_params)
         
         logger.debug(f"[PFC]发送到LLM的提示词: {prompt[:500]}...")
         
         try:
-            models = llm_api.get_available_models()
-            planner_config = models.get("planner") or models.get("normal")
+            planner_config = self._get_planner_config()
             
             if not planner_config:
                 logger.warning("[PFC] 未找到 planner 模型配置")
-                return "", "", ""
+                return ""
             
-            success, content, _, _ = await llm_api.generate_with_model(
-                prompt=prompt,
-                model_config=planner_config,
-                request_type="pfc.goal_analysis",
+            success, content = await self._generate_cached(
+                prompt, planner_config, "pfc.goal_analysis"
             )
             
             if not success or not content:
                 logger.warning(f"[PFC]LLM调用失败: {content}")
-                return "", "", ""
+                return ""
             
             logger.debug(f"[PFC]LLM原始返回内容: {content}")
+            return content
         except Exception as e:
             logger.error(f"[PFC]分析对话目标时出错: {e}")
-            return "", "", ""
-        
-        # 解析JSON响应
-        result = self._parse_goal_response(content, conversation_info)
-        
-        return result
+            return ""
     
     async def _build_prompt_params(
         self,
@@ -268,20 +347,33 @@ class GoalAnalyzer:
         Returns:
             格式化的聊天历史文本
         """
-        chat_history_text = observation_info.chat_history_str
+        chat_history_str = observation_info.chat_history_str
+        unprocessed = observation_info.unprocessed_messages
+        last_message = unprocessed[-1] if unprocessed else None
+        
+        # 历史与未处理消息均未变化时复用上次结果（按对象身份比较，开销为常数）
+        cached = self._history_text_cache
+        if (cached is not None
+                and cached[0] is chat_history_str
+                and cached[1] == observation_info.new_messages_count
+                and cached[2] == len(unprocessed)
+                and cached[3] is last_message):
+            return cached[4]
+        
+        chat_history_text = chat_history_str
         
         # 如果有新消息，添加新消息部分
-        if (observation_info.new_messages_count > 0 and 
-            observation_info.unprocessed_messages):
-            
-            new_messages_str = self._format_messages(
-                observation_info.unprocessed_messages
-            )
+        if observation_info.new_messages_count > 0 and unprocessed:
+            new_messages_str = self._format_messages(unprocessed)
             chat_history_text += (
                 f"\n--- 以下是 {observation_info.new_messages_count} "
                 f"条新消息 ---\n{new_messages_str}"
             )
         
+        self._history_text_cache = (
+            chat_history_str, observation_info.new_messages_count,
+            len(unprocessed), last_message, chat_history_text,
+        )
         return chat_history_text
     
     def _format_messages(self, messages: List[Dict[str, Any]]) -> str:
@@ -297,19 +389,37 @@ class GoalAnalyzer:
         if not messages:
             return ""
         
-        formatted_lines = []
-        for msg in messages:
-            sender = msg.get("sender", {})
-            sender_name = sender.get("nickname", "未知用户")
-            content = msg.get("processed_plain_text", msg.get("content", ""))
+        # 列表在上次渲染的基础上只追加了新消息时，复用已渲染的前缀（按对象身份比较）
+        cached = self._format_cache
+        start, prefix = 0, ""
+        if (cached is not None
+                and len(messages) >= cached[0]
+                and messages[0] is cached[1]
+                and messages[cached[0] - 1] is cached[2]):
+            start, prefix = cached[0], cached[3]
+            if start == len(messages):
+                return prefix
+        
+        bot_qq = str(global_config.bot.qq_account)
+        bot_name = self.bot_name
+        get = dict.get
+        formatted_lines = [prefix] if prefix else []
+        append = formatted_lines.append
+        for msg in messages[start:]:
+            sender = get(msg, "sender") or _EMPTY
+            content = get(msg, "processed_plain_text") or get(msg, "content", "")
             
             # 替换机器人名称
-            if sender.get("user_id") == str(global_config.bot.qq_account):
-                sender_name = self.bot_name
+            if get(sender, "user_id") == bot_qq:
+                sender_name = bot_name
+            else:
+                sender_name = get(sender, "nickname", "未知用户")
             
-            formatted_lines.append(f"{sender_name}: {content}")
+            append(f"{sender_name}: {content}")
         
-        return "\n".join(formatted_lines)
+        text = "\n".join(formatted_lines)
+        self._format_cache = (len(messages), messages[0], messages[-1], text)
+        return text
     
     def _build_action_history_text(
         self,
@@ -327,9 +437,9 @@ class GoalAnalyzer:
         if not done_action:
             return "你之前做的事情是：暂无\n"
         
-        action_history_text = "你之前做的事情是：\n"
-        for action in done_action:
-            action_history_text += f"{action}\n"
+        parts = ["你之前做的事情是："]
+        parts.extend(str(action) for action in done_action)
+        action_history_text = "\n".join(parts) + "\n"
         
         return action_history_text
     
@@ -348,34 +458,68 @@ class GoalAnalyzer:
         Returns:
             (目标, 方法, 原因) 元组
         """
-        # 尝试解析JSON数组
+        # 只扫描一次括号位置：先按首个出现的括号选择解析器，失败时再尝试另一种
+        # （如 {"goals": [...]} 或正文中夹杂零散括号的响应）
+        array_pos = content.find("[")
+        object_pos = content.find("{")
+        parsers = []
+        if array_pos >= 0:
+            parsers.append(self._parse_goal_array)
+        if object_pos >= 0:
+            parsers.append(self._parse_goal_object)
+        if len(parsers) == 2 and object_pos < array_pos:
+            parsers.reverse()
+        
+        for parse in parsers:
+            result = parse(content, conversation_info)
+            if result is not None:
+                return result
+        
+        logger.warning(
+            f"[PFC]无法解析目标响应: {content[:100]}..."
+        )
+        return "", "", ""
+    
+    @staticmethod
+    def _parse_goal_array(
+        content: str,
+        conversation_info: ConversationInfo
+    ) -> Optional[Tuple[str, str, str]]:
+        """按JSON数组解析目标响应，成功时替换目标列表并返回第一个目标，否则返回 None"""
         result = extract_json_array_from_text(content)
+        if not result or not isinstance(result, list):
+            return None
         
-        if result and isinstance(result, list):
-            # 清空现有目标列表并添加新目标
-            conversation_info.goal_list = []
-            
-            for item in result:
-                if isinstance(item, dict):
-                    goal = item.get("goal", "")
-                    reasoning = item.get("reasoning", "")
-                    
-                    if goal:
-                        conversation_info.goal_list.append({
-                            "goal": goal,
-                            "reasoning": reasoning
-                        })
-            
-            # 返回第一个目标作为当前主要目标
-            if conversation_info.goal_list:
-                first_goal = conversation_info.goal_list[0]
-                return (
-                    first_goal.get("goal", ""),
-                    "",
-                    first_goal.get("reasoning", "")
-                )
-        
-        # 尝试解析单个JSON对象
+        # 清空现有目标列表并添加新目标
+        conversation_info.goal_list = []
+        
+        for item in result:
+            if isinstance(item, dict):
+                goal = item.get("goal", "")
+                reasoning = item.get("reasoning", "")
+                
+                if goal:
+                    conversation_info.goal_list.append({
+                        "goal": goal,
+                        "reasoning": reasoning
+                    })
+        
+        # 返回第一个目标作为当前主要目标
+        if conversation_info.goal_list:
+            first_goal = conversation_info.goal_list[0]
+            return (
+                first_goal.get("goal", ""),
+                "",
+                first_goal.get("reasoning", "")
+            )
+        return None
+    
+    @staticmethod
+    def _parse_goal_object(
+        content: str,
+        conversation_info: ConversationInfo
+    ) -> Optional[Tuple[str, str, str]]:
+        """按单个JSON对象解析目标响应，成功时追加到目标列表，否则返回 None"""
         result = extract_json_from_text(content)
         
         if result and isinstance(result, dict):
@@ -388,11 +532,7 @@ class GoalAnalyzer:
                     "reasoning": reasoning
                 })
                 return goal, "", reasoning
-        
-        logger.warning(
-            f"[PFC]无法解析目标响应: {content[:100]}..."
-        )
-        return "", "", ""
+        return None
     
     async def analyze_conversation(
         self,
@@ -412,11 +552,13 @@ class GoalAnalyzer:
             (goal_achieved, stop_conversation, reason) 元组
         """
         # 使用共享模块获取人格信息
-        personality_info = await self._personality_helper.get_personality_info()
-        persona_text = f"你的名字是{self.bot_name}，{personality_info}。"
+        if self._persona_text is None:
+            personality_info = await self._personality_helper.get_personality_info()
+            self._persona_text = f"你的名字是{self.bot_name}，{personality_info}。"
+        persona_text = self._persona_text
         current_time_str = get_current_time_str()
         
-        prompt = PROMPT_ANALYZE_CONVERSATION.format(
+        prompt = _CONVERSATION_TEMPLATE.format(
             persona_text=persona_text,
             goal=goal,
             reasoning=reasoning,
@@ -425,17 +567,14 @@ class GoalAnalyzer:
         )
         
         try:
-            models = llm_api.get_available_models()
-            planner_config = models.get("planner") or models.get("normal")
+            planner_config = self._get_planner_config()
             
             if not planner_config:
                 logger.warning("[PFC] 未找到 planner 模型配置")
                 return False, False, "未找到模型配置"
             
-            success, content, _, _ = await llm_api.generate_with_model(
-                prompt=prompt,
-                model_config=planner_config,
-                request_type="pfc.conversation_analysis",
+            success, content = await self._generate_cached(
+                prompt, planner_config, "pfc.conversation_analysis"
             )
             
             if not success or not content:
@@ -448,15 +587,10 @@ class GoalAnalyzer:
             result = extract_json_from_text(content)
             
             if result and isinstance(result, dict):
-                goal_achieved = result.get("goal_achieved", False)
-                stop_conversation = result.get("stop_conversation", False)
-                reason = result.get("reason", "")
-                
                 # 确保类型正确
-                if isinstance(goal_achieved, str):
-                    goal_achieved = goal_achieved.lower() == "true"
-                if isinstance(stop_conversation, str):
-                    stop_conversation = stop_conversation.lower() == "true"
+                goal_achieved = to_bool(result.get("goal_achieved", False))
+                stop_conversation = to_bool(result.get("stop_conversation", False))
+                reason = result.get("reason", "")
                 
                 return goal_achieved, stop_conversation, reason
             
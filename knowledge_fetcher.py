@@ -21,10 +21,17 @@ PFC知识获取器模块
 """
 from __future__ import annotations
 
+import asyncio
+import hashlib
+from collections import Counter
+from io import StringIO
 from typing import List, Tuple, Dict, Any
 from src.common.logger import get_logger
 from src.plugin_system.apis import llm_api
 
+from .models import RetrievedItem
+from .shared import TTLCache, is_debug_enabled, take_last
+
 # PFCConfig 类型注解使用 TYPE_CHECKING
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -32,6 +39,81 @@ if TYPE_CHECKING:
 
 logger = get_logger("PFC-KnowledgeFetcher")
 
+# 知识总结缓存：相同问题与知识文本直接复用上次的总结（跨会话共享）
+_summary_cache = TTLCache(maxsize=256, ttl=600.0)
+# 知识条数不超过该值且总长度不足 _SUMMARY_MIN_CHARS 时不调用 LLM 总结，直接返回原文
+_SUMMARY_MAX_DIRECT_ITEMS = 3
+_SUMMARY_MIN_CHARS = 1500
+# 知识总结的 LLM 超时（秒），超时后退回截断的原文
+_SUMMARY_TIMEOUT_SECONDS = 5.0
+
+# 知识库查询缓存：按 (qa_manager 身份, 规范化查询) 缓存 LPMM 的查询结果，常见查询直接命中
+_kb_cache = TTLCache(maxsize=512, ttl=300.0)
+_kb_cache_stats: Counter = Counter()  # 命中/未命中计数，随查询日志输出，用于调整缓存容量
+
+# LPMM 查询是同步的向量检索，放到线程中执行；原生库未声明线程安全，同一时间只允许一个查询
+# 锁在首次查询时于运行中的事件循环内创建
+_kb_lock: asyncio.Lock | None = None
+
+# 消息缺少 sender 字段时使用的只读空字典
+_EMPTY: Dict[str, Any] = {}
+
+# 依赖不可用的标记：导入失败后不再重复尝试
+_MISSING = object()
+
+# 记忆系统与知识库入口：首次使用时导入一次，导入失败记为 _MISSING 后不再重试
+# （失败的导入不会留在 sys.modules 中，重试会在事件循环上重复整个导入，知识库还会重复初始化 LPMM）
+_get_memory_manager: Any = None
+_knowledge_lib: Any = None
+
+# 已输出过的“依赖不可用”警告，每类只提示一次
+_warned_unavailable: set = set()
+
+
+def _warn_unavailable_once(kind: str, message: str) -> None:
+    """同一类依赖不可用的警告只输出一次"""
+    if kind not in _warned_unavailable:
+        _warned_unavailable.add(kind)
+        logger.warning(message)
+
+
+def _get_kb_lock() -> asyncio.Lock:
+    """获取知识库查询锁（首次调用时创建）"""
+    global _kb_lock
+    if _kb_lock is None:
+        _kb_lock = asyncio.Lock()
+    return _kb_lock
+
+
+def _resolve_memory_manager_factory():
+    """导入记忆管理器入口（只尝试一次），不可用时返回 None"""
+    global _get_memory_manager
+    if _get_memory_manager is None:
+        try:
+            from src.memory_graph.manager_singleton import get_memory_manager
+            _get_memory_manager = get_memory_manager
+        except Exception as e:
+            _get_memory_manager = _MISSING
+            _warn_unavailable_once("memory", f"[PFC]无法导入MemoryManager，记忆功能不可用: {e}")
+    return None if _get_memory_manager is _MISSING else _get_memory_manager
+
+
+def _resolve_knowledge_lib():
+    """导入知识库模块（只尝试一次），不可用时返回 None"""
+    global _knowledge_lib
+    if _knowledge_lib is None:
+        try:
+            # 导入模块而非 qa_manager 本身：qa_manager 可能在主程序初始化知识库后才被赋值
+            from src.chat.knowledge import knowledge_lib
+            _knowledge_lib = knowledge_lib
+        except Exception as e:  # 知识库模块导入时会初始化 LPMM，任何异常都视为不可用
+            _knowledge_lib = _MISSING
+            _warn_unavailable_once("qa", f"[PFC]无法导入qa_manager，知识库功能不可用: {e}")
+    return None if _knowledge_lib is _MISSING else _knowledge_lib
+
+# 进行中的记忆检索：相同查询并发到达时共享同一次检索（按 (查询文本, top_k) 区分）
+_inflight_memory_searches: Dict[Tuple[str, int], asyncio.Future] = {}
+
 
 class KnowledgeFetcher:
     """
@@ -55,10 +137,14 @@ class KnowledgeFetcher:
         self.private_name = private_name
         self.config = config
         
-        # 记忆管理器（延迟初始化）
+        # 记忆管理器等依赖（延迟初始化，失败时记为 _MISSING；结果为 None 表示尚未初始化，下次访问时重试）
         self._memory_manager = None
         self._qa_manager = None
         self._web_search_tool = None
+        # 记忆检索结果缓存：查询与聊天上下文均未变化时（如空闲时重新思考）直接复用
+        self._memory_cache = TTLCache(maxsize=64, ttl=10.0)
+        # 上次渲染的聊天历史：(消息条数, 最后一条消息, 渲染文本)
+        self._history_render_cache = None
         
         logger.debug(f"[私聊][{private_name}]知识获取器初始化完成")
     
@@ -66,43 +152,34 @@ class KnowledgeFetcher:
     def memory_manager(self):
         """延迟加载记忆管理器"""
         if self._memory_manager is None:
+            get_memory_manager = _resolve_memory_manager_factory()
+            if get_memory_manager is None:
+                return None
             try:
-                from src.memory_graph.manager_singleton import get_memory_manager
+                # 管理器尚未初始化时返回 None，保留下次访问时重试
                 self._memory_manager = get_memory_manager()
                 if self._memory_manager is None:
                     logger.warning(
                         f"[私聊][{self.private_name}]"
                         "MemoryManager未初始化，记忆功能不可用"
                     )
-            except ImportError:
-                logger.warning(
-                    f"[私聊][{self.private_name}]"
-                    "无法导入MemoryManager，记忆功能不可用"
-                )
             except Exception as e:
+                self._memory_manager = _MISSING
                 logger.error(
                     f"[私聊][{self.private_name}]"
                     f"获取MemoryManager失败: {e}"
                 )
-        return self._memory_manager
+        return None if self._memory_manager is _MISSING else self._memory_manager
     
     @property
     def qa_manager(self):
         """延迟加载QA管理器"""
         if self._qa_manager is None:
-            try:
-                from src.chat.knowledge.knowledge_lib import qa_manager
-                self._qa_manager = qa_manager
-            except ImportError:
-                logger.warning(
-                    f"[私聊][{self.private_name}]"
-                    "无法导入qa_manager，知识库功能不可用"
-                )
-            except Exception as e:
-                logger.error(
-                    f"[私聊][{self.private_name}]"
-                    f"初始化qa_manager失败: {e}"
-                )
+            knowledge_lib = _resolve_knowledge_lib()
+            if knowledge_lib is None:
+                return None
+            # 知识库尚未初始化时为 None，保留下次访问时重试
+            self._qa_manager = getattr(knowledge_lib, "qa_manager", None)
         return self._qa_manager
     
     @property
@@ -117,16 +194,18 @@ class KnowledgeFetcher:
                     "联网搜索工具初始化成功"
                 )
             except ImportError:
+                self._web_search_tool = _MISSING
                 logger.warning(
                     f"[私聊][{self.private_name}]"
                     "无法导入WebSurfingTool，联网搜索功能不可用"
                 )
             except Exception as e:
+                self._web_search_tool = _MISSING
                 logger.error(
                     f"[私聊][{self.private_name}]"
                     f"初始化WebSurfingTool失败: {e}"
                 )
-        return self._web_search_tool
+        return None if self._web_search_tool is _MISSING else self._web_search_tool
     
     async def fetch(
         self,
@@ -143,57 +222,102 @@ class KnowledgeFetcher:
         Returns:
             (获取的知识, 知识来源) 元组
         """
-        logger.debug(f"[私聊][{self.private_name}]开始获取知识: {query[:50]}...")
+        if is_debug_enabled(logger):
+            logger.debug(f"[私聊][{self.private_name}]开始获取知识: {query[:50]}...")
         
         # 构建查询上下文
         chat_history_text = self._format_chat_history(chat_history)
         
-        knowledge_parts = []
+        # 各来源的知识块直接写入同一缓冲区，块之间以换行分隔
+        buf = StringIO()
         sources = []
         
-        # 从记忆系统获取相关知识
-        memory_knowledge, memory_sources = await self._fetch_from_memory(
-            query,
-            chat_history_text
-        )
-        if memory_knowledge:
-            knowledge_parts.append(memory_knowledge)
-            sources.extend(memory_sources)
-        
-        # 从知识库获取相关知识
-        kb_knowledge = self._fetch_from_knowledge_base(query)
-        if kb_knowledge and kb_knowledge != "未找到匹配的知识":
-            knowledge_parts.append(
-                f"\n现在有以下**知识**可供参考：\n{kb_knowledge}\n"
-                "请记住这些**知识**，并根据**知识**回答问题。\n"
-            )
+        # 记忆系统、知识库与联网搜索互不依赖，并发获取
+        web_enabled = self.config.web_search.enabled
+        fetches = [
+            self._fetch_from_memory(query, chat_history_text),
+            self._fetch_from_knowledge_base(query),
+        ]
+        if web_enabled:
+            fetches.append(self._fetch_from_web_search(query))
+        results = await asyncio.gather(*fetches, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"[私聊][{self.private_name}]获取知识失败: {result}")
+        memory_result, kb_knowledge = results[0], results[1]
+        web_knowledge = results[2] if web_enabled else ""
+        
+        # 记忆系统的结果
+        if not isinstance(memory_result, Exception):
+            memory_knowledge, memory_sources = memory_result
+            if memory_knowledge:
+                buf.write(memory_knowledge)
+                sources.extend(memory_sources)
+        
+        # 知识库的结果
+        if isinstance(kb_knowledge, str) and kb_knowledge and kb_knowledge != "未找到匹配的知识":
+            if buf.tell():
+                buf.write("\n")
+            buf.write("\n现在有以下**知识**可供参考：\n")
+            buf.write(kb_knowledge)
+            buf.write("\n请记住这些**知识**，并根据**知识**回答问题。\n")
             sources.append("知识库")
         
-        # 从联网搜索获取相关知识（如果启用）
-        if self.config.web_search.enabled:
-            web_knowledge = await self._fetch_from_web_search(query)
-            if web_knowledge:
-                knowledge_parts.append(
-                    f"\n现在有以下**联网搜索结果**可供参考：\n{web_knowledge}\n"
-                    "请参考这些最新信息回答问题。\n"
-                )
-                sources.append("联网搜索")
+        # 联网搜索的结果（如果启用）
+        if isinstance(web_knowledge, str) and web_knowledge:
+            if buf.tell():
+                buf.write("\n")
+            buf.write("\n现在有以下**联网搜索结果**可供参考：\n")
+            buf.write(web_knowledge)
+            buf.write("\n请参考这些最新信息回答问题。\n")
+            sources.append("联网搜索")
         
         # 组合知识
-        if knowledge_parts:
-            knowledge_text = "\n".join(knowledge_parts)
+        knowledge_text = buf.getvalue()
+        if knowledge_text:
             sources_text = "，".join(sources) if sources else "无来源"
         else:
             knowledge_text = "未找到相关知识"
             sources_text = "无记忆匹配"
         
-        logger.debug(
-            f"[私聊][{self.private_name}]获取到知识: "
-            f"{knowledge_text[:100]}..., 来源: {sources_text}"
-        )
+        if is_debug_enabled(logger):
+            logger.debug(
+                f"[私聊][{self.private_name}]获取到知识: "
+                f"{knowledge_text[:100]}..., 来源: {sources_text}"
+            )
         
         return knowledge_text, sources_text
     
+    async def _search_memories(self, query: str, top_k: int) -> list:
+        """
+        检索记忆，相同查询正在进行时直接等待其结果，避免重复的向量检索
+        
+        Args:
+            query: 检索文本
+            top_k: 返回数量
+            
+        Returns:
+            记忆列表
+        """
+        key = (query, top_k)
+        future = _inflight_memory_searches.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.memory_manager.search_memories(
+                query=query,
+                top_k=top_k,
+                min_importance=0.0,
+                include_forgotten=False,
+            ))
+            _inflight_memory_searches[key] = future
+            
+            def _forget(done: asyncio.Future) -> None:
+                if _inflight_memory_searches.get(key) is done:
+                    del _inflight_memory_searches[key]
+            
+            future.add_done_callback(_forget)
+        # shield：某个等待方被取消时不影响其他共享该检索的调用
+        return await asyncio.shield(future)
+    
     async def _fetch_from_memory(
         self,
         query: str,
@@ -212,29 +336,37 @@ class KnowledgeFetcher:
         if not self.memory_manager:
             return "", []
         
+        cache_key = (query, chat_history_text)
+        cached = self._memory_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             # 使用 MoFox_Bot 的 MemoryManager.search_memories
             search_query = f"{query}\n{chat_history_text}"
-            memories = await self.memory_manager.search_memories(
-                query=search_query,
-                top_k=3,
-                min_importance=0.0,
-                include_forgotten=False,
-            )
+            memories = await self._search_memories(search_query, 3)
             
             if not memories:
+                self._memory_cache.set(cache_key, ("", []))
                 return "", []
             
             knowledge_parts = []
             sources = []
+            seen_ids = set()
+            seen_add = seen_ids.add
             
             for memory in memories:
+                # 检索结果可能包含重复的记忆，只保留第一次出现的
+                if memory.id in seen_ids:
+                    continue
+                seen_add(memory.id)
                 # Memory 对象有 to_text() 方法
                 memory_text = memory.to_text()
                 knowledge_parts.append(memory_text)
                 sources.append(f"记忆片段{memory.id[:8]}")
             
             knowledge_text = "\n".join(knowledge_parts)
+            self._memory_cache.set(cache_key, (knowledge_text, sources))
             return knowledge_text, sources
             
         except Exception as e:
@@ -243,10 +375,12 @@ class KnowledgeFetcher:
             )
             return "", []
     
-    def _fetch_from_knowledge_base(self, query: str) -> str:
+    async def _fetch_from_knowledge_base(self, query: str) -> str:
         """
         从知识库获取相关知识
         
+        LPMM 查询为同步调用，在线程中执行以免阻塞事件循环
+        
         Args:
             query: 查询内容
             
@@ -256,14 +390,34 @@ class KnowledgeFetcher:
         if not self.qa_manager:
             return ""
         
-        logger.debug(f"[私聊][{self.private_name}]正在从LPMM知识库中获取知识")
+        qa_manager = self.qa_manager
+        key = (id(qa_manager), query.strip().lower())
+        cached = _kb_cache.get(key)
+        _kb_cache_stats["hit" if cached is not None else "miss"] += 1
+        if cached is not None:
+            if is_debug_enabled(logger):
+                logger.debug(
+                    f"[私聊][{self.private_name}]命中LPMM知识库查询缓存 "
+                    f"(命中 {_kb_cache_stats['hit']} / 未命中 {_kb_cache_stats['miss']})"
+                )
+            return cached
         
-        try:
-            knowledge_info = self.qa_manager.get_knowledge(query)
+        if is_debug_enabled(logger):
             logger.debug(
-                f"[私聊][{self.private_name}]LPMM知识库查询结果: "
-                f"{str(knowledge_info)[:150]}"
+                f"[私聊][{self.private_name}]正在从LPMM知识库中获取知识 "
+                f"(缓存命中 {_kb_cache_stats['hit']} / 未命中 {_kb_cache_stats['miss']})"
             )
+        
+        try:
+            async with _get_kb_lock():
+                knowledge_info = await asyncio.to_thread(qa_manager.get_knowledge, query)
+            if is_debug_enabled(logger):
+                logger.debug(
+                    f"[私聊][{self.private_name}]LPMM知识库查询结果: "
+                    f"{str(knowledge_info)[:150]}"
+                )
+            if knowledge_info is not None:
+                _kb_cache.set(key, knowledge_info)
             return knowledge_info
         except Exception as e:
             logger.error(
@@ -284,7 +438,8 @@ class KnowledgeFetcher:
         if not self.web_search_tool:
             return ""
         
-        logger.debug(f"[私聊][{self.private_name}]正在进行联网搜索: {query[:50]}...")
+        if is_debug_enabled(logger):
+            logger.debug(f"[私聊][{self.private_name}]正在进行联网搜索: {query[:50]}...")
         
         try:
             # 构建搜索参数
@@ -307,10 +462,11 @@ class KnowledgeFetcher:
             # 获取搜索结果内容
             content = result.get("content", "")
             if content:
-                logger.debug(
-                    f"[私聊][{self.private_name}]联网搜索成功，"
-                    f"结果长度: {len(content)}"
-                )
+                if is_debug_enabled(logger):
+                    logger.debug(
+                        f"[私聊][{self.private_name}]联网搜索成功，"
+                        f"结果长度: {len(content)}"
+                    )
                 return content
             
             return ""
@@ -337,21 +493,27 @@ class KnowledgeFetcher:
         if not chat_history:
             return ""
         
-        formatted_lines = []
-        for msg in chat_history[-10:]:  # 只取最近10条
-            sender = msg.get("sender", {})
-            sender_name = sender.get("nickname", "未知用户")
-            content = msg.get("processed_plain_text", msg.get("content", ""))
-            formatted_lines.append(f"{sender_name}: {content}")
-        
-        return "\n".join(formatted_lines)
+        # 历史未变化（条数与最后一条消息均相同）时复用上次渲染结果
+        last_message = chat_history[-1]
+        cached = self._history_render_cache
+        if cached is not None and cached[0] == len(chat_history) and cached[1] is last_message:
+            return cached[2]
+        
+        get = dict.get
+        text = "\n".join(
+            f"{get(get(msg, 'sender') or _EMPTY, 'nickname', '未知用户')}: "
+            f"{get(msg, 'processed_plain_text') or get(msg, 'content', '')}"
+            for msg in take_last(chat_history, 10)  # 只取最近10条
+        )
+        self._history_render_cache = (len(chat_history), last_message, text)
+        return text
     
     async def fetch_with_context(
         self,
         query: str,
         context: str,
         max_results: int = 5
-    ) -> List[Dict[str, Any]]:
+    ) -> List[RetrievedItem]:
         """
         带上下文的知识获取
         
@@ -361,60 +523,72 @@ class KnowledgeFetcher:
             max_results: 最大结果数
             
         Returns:
-            知识结果列表
+            知识结果列表（需要字典时调用 to_dict()）
         """
-        results = []
-        
-        # 从记忆获取
-        if self.memory_manager:
-            try:
-                memories = await self.memory_manager.search_memories(
-                    query=f"{query}\n{context}",
-                    top_k=max_results,
-                    min_importance=0.0,
-                    include_forgotten=False,
-                )
-                
-                for memory in memories or []:
-                    results.append({
-                        "type": "memory",
-                        "id": memory.id,
-                        "content": memory.to_text(),
-                        "source": f"记忆片段{memory.id[:8]}"
-                    })
-            except Exception as e:
-                logger.error(f"[私聊][{self.private_name}]获取记忆失败: {e}")
-        
-        # 从知识库获取
-        if self.qa_manager and len(results) < max_results:
-            try:
-                kb_result = self.qa_manager.get_knowledge(query)
-                if kb_result and kb_result != "未找到匹配的知识":
-                    results.append({
-                        "type": "knowledge_base",
-                        "id": "kb_0",
-                        "content": kb_result,
-                        "source": "知识库"
-                    })
-            except Exception as e:
-                logger.error(f"[私聊][{self.private_name}]获取知识库失败: {e}")
-        
-        # 从联网搜索获取
+        results: List[RetrievedItem] = []
+        
+        # 记忆与知识库并发获取；
+        # 知识库结果在记忆结果之后、且数量未满时才采用
+        memory_manager = self.memory_manager
+        fetches = [
+            self._search_memories(f"{query}\n{context}", max_results) if memory_manager else asyncio.sleep(0),
+            self._fetch_from_knowledge_base(query),
+        ]
+        memories, kb_result = await asyncio.gather(*fetches, return_exceptions=True)
+        
+        # 记忆的结果
+        if isinstance(memories, Exception):
+            logger.error(f"[私聊][{self.private_name}]获取记忆失败: {memories}")
+        else:
+            seen_ids = set()
+            for memory in memories or []:
+                if memory.id in seen_ids:
+                    continue
+                seen_ids.add(memory.id)
+                results.append(RetrievedItem("memory", memory.id, memory.to_text(), f"记忆片段{memory.id[:8]}"))
+        
+        # 知识库的结果
+        if isinstance(kb_result, Exception):
+            logger.error(f"[私聊][{self.private_name}]获取知识库失败: {kb_result}")
+        elif kb_result and kb_result != "未找到匹配的知识" and len(results) < max_results:
+            results.append(RetrievedItem("knowledge_base", "kb_0", kb_result, "知识库"))
+        
+        # 从联网搜索获取（外部调用开销较大，仍在结果不足时才发起）
         if self.config.web_search.enabled and len(results) < max_results:
             try:
                 web_result = await self._fetch_from_web_search(query)
                 if web_result:
-                    results.append({
-                        "type": "web_search",
-                        "id": "web_0",
-                        "content": web_result,
-                        "source": "联网搜索"
-                    })
+                    results.append(RetrievedItem("web_search", "web_0", web_result, "联网搜索"))
             except Exception as e:
                 logger.error(f"[私聊][{self.private_name}]获取联网搜索失败: {e}")
         
         return results[:max_results]
     
+    async def fetch_many(
+        self,
+        queries: List[str],
+        context: str,
+        max_results: int = 5
+    ) -> Dict[str, List[RetrievedItem]]:
+        """
+        批量带上下文的知识获取
+        
+        相同的查询只执行一次，不同查询之间并发获取
+        
+        Args:
+            queries: 查询内容列表
+            context: 上下文信息
+            max_results: 每个查询的最大结果数
+            
+        Returns:
+            查询内容 → 知识结果列表 的映射
+        """
+        unique_queries = list(dict.fromkeys(queries))
+        results = await asyncio.gather(
+            *(self.fetch_with_context(query, context, max_results) for query in unique_queries)
+        )
+        return dict(zip(unique_queries, results))
+    
     async def summarize_knowledge(
         self,
         knowledge_list: List[Dict[str, Any]],
@@ -436,15 +610,22 @@ class KnowledgeFetcher:
             return "未找到相关知识"
         
         # 构建知识文本
-        knowledge_text = ""
-        for i, item in enumerate(knowledge_list):
-            content = item.get("content", "")
-            source = item.get("source", "未知来源")
-            knowledge_text += f"{i+1}. [{source}] {content}\n\n"
+        knowledge_text = "".join(
+            f"{i}. [{item.get('source', '未知来源')}] {item.get('content', '')}\n\n"
+            for i, item in enumerate(knowledge_list, 1)
+        )
         
-        # 如果知识较短，直接返回
+        # 如果知识较短（或条数少且总量不大），直接返回，总结的开销得不偿失
         if len(knowledge_text) < 500:
             return knowledge_text
+        if (len(knowledge_list) <= _SUMMARY_MAX_DIRECT_ITEMS
+                and sum(len(item.get("content", "")) for item in knowledge_list) < _SUMMARY_MIN_CHARS):
+            return knowledge_text
+        
+        key = hashlib.blake2b(f"{query}\x00{knowledge_text}".encode(), digest_size=16).digest()
+        cached = _summary_cache.get(key)
+        if cached is not None:
+            return cached
         
         # 使用LLM总结
         prompt = f"""请根据以下知识内容，针对问题"{query}"进行简洁的总结：
@@ -454,13 +635,27 @@ class KnowledgeFetcher:
 请用简洁的语言总结上述知识中与问题相关的要点，不超过200字。"""
         
         try:
-            summary = await llm_api.generate_with_model(
-                model_name=self.config.llm.chat_model,
-                prompt=prompt,
-                temperature=0.3,
-                max_tokens=300
+            models = llm_api.get_available_models()
+            model_config = models.get("utils") or models.get("normal")
+            if not model_config:
+                return knowledge_text[:500] + "..."
+            success, summary, _, _ = await asyncio.wait_for(
+                llm_api.generate_with_model(
+                    prompt=prompt,
+                    model_config=model_config,
+                    request_type="pfc.knowledge_summary",
+                ),
+                _SUMMARY_TIMEOUT_SECONDS,
             )
+            if not success or not summary:
+                return knowledge_text[:500] + "..."
+            _summary_cache.set(key, summary)
             return summary
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"[私聊][{self.private_name}]总结知识超时 ({_SUMMARY_TIMEOUT_SECONDS} 秒)，使用原文"
+            )
+            return knowledge_text[:500] + "..."
         except Exception as e:
             logger.error(f"[私聊][{self.private_name}]总结知识失败: {e}")
             return knowledge_text[:500] + "..."
\ No newline at end of file
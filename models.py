@@ -1,13 +1,23 @@
 """PFC 数据模型 - 定义核心数据结构 (GPL-3.0)"""
 
 import time
+from collections import deque
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Optional
+from typing import Any, Optional, TypeVar
 
+# 行动历史保留条数（超出后自动丢弃最旧的记录）
+DONE_ACTION_MAXLEN = 200
+# 知识与工具结果保留条数
+RECENT_RESULTS_MAXLEN = 10
+# 聊天历史保留条数
+CHAT_HISTORY_MAXLEN = 100
 
-class ConversationState(Enum):
-    """对话状态"""
+_ModelT = TypeVar("_ModelT")
+
+
+class ConversationState(str, Enum):
+    """对话状态（str 混入：成员本身即为其取值字符串）"""
     INIT = "init"
     ANALYZING = "analyzing"
     GENERATING = "generating"
@@ -18,12 +28,13 @@ class ConversationState(Enum):
     RETHINKING = "rethinking"
     IGNORED = "ignored"
 
-    def __str__(self) -> str:
-        return self.value
+    # 直接使用 str 的实现，str()/格式化无需经过 Enum 的方法分派
+    __str__ = str.__str__
+    __format__ = str.__format__
 
 
-class ActionType(Enum):
-    """行动类型"""
+class ActionType(str, Enum):
+    """行动类型（str 混入：成员本身即为其取值字符串）"""
     DIRECT_REPLY = "direct_reply"
     SEND_NEW_MESSAGE = "send_new_message"
     FETCH_KNOWLEDGE = "fetch_knowledge"
@@ -35,11 +46,17 @@ class ActionType(Enum):
     SAY_GOODBYE = "say_goodbye"
     BLOCK_AND_IGNORE = "block_and_ignore"
 
-    def __str__(self) -> str:
-        return self.value
+    # 直接使用 str 的实现，str()/格式化无需经过 Enum 的方法分派
+    __str__ = str.__str__
+    __format__ = str.__format__
+
 
+# 取值 → 成员 的映射：从字符串解析时用 .get(value, 默认成员)，避免构造枚举失败时的异常开销
+CONVERSATION_STATE_BY_VALUE: dict[str, ConversationState] = {m.value: m for m in ConversationState}
+ACTION_TYPE_BY_VALUE: dict[str, ActionType] = {m.value: m for m in ActionType}
 
-@dataclass
+
+@dataclass(slots=True)
 class GoalItem:
     goal: str
     reasoning: str
@@ -52,7 +69,7 @@ class GoalItem:
         return cls(goal=data.get("goal", ""), reasoning=data.get("reasoning", ""))
 
 
-@dataclass
+@dataclass(slots=True)
 class ActionRecord:
     action: str
     plan_reason: str
@@ -71,7 +88,7 @@ class ActionRecord:
                    final_reason=data.get("final_reason"))
 
 
-@dataclass
+@dataclass(slots=True)
 class KnowledgeItem:
     query: str
     knowledge: str
@@ -81,34 +98,54 @@ class KnowledgeItem:
         return {"query": self.query, "knowledge": self.knowledge, "source": self.source}
 
 
-@dataclass
+@dataclass(slots=True)
+class RetrievedItem:
+    """知识检索结果（记忆 / 知识库 / 联网搜索）"""
+    type: str
+    id: str
+    content: str
+    source: str
+
+    def to_dict(self) -> dict[str, str]:
+        return {"type": self.type, "id": self.id, "content": self.content, "source": self.source}
+
+
+@dataclass(slots=True)
 class ConversationInfo:
     """对话信息"""
-    done_action: list[dict] = field(default_factory=list)
+    done_action: deque[dict] = field(default_factory=lambda: deque(maxlen=DONE_ACTION_MAXLEN))
     goal_list: list[dict] = field(default_factory=list)
-    knowledge_list: list[dict] = field(default_factory=list)
+    knowledge_list: deque[dict] = field(default_factory=lambda: deque(maxlen=RECENT_RESULTS_MAXLEN))
     memory_list: list[dict] = field(default_factory=list)
-    tool_results: list[dict] = field(default_factory=list)
+    tool_results: deque[dict] = field(default_factory=lambda: deque(maxlen=RECENT_RESULTS_MAXLEN))
     last_successful_reply_action: Optional[str] = None
 
+    def __post_init__(self) -> None:
+        if not isinstance(self.done_action, deque):
+            self.done_action = deque(self.done_action or (), maxlen=DONE_ACTION_MAXLEN)
+        if not isinstance(self.knowledge_list, deque):
+            self.knowledge_list = deque(self.knowledge_list or (), maxlen=RECENT_RESULTS_MAXLEN)
+        if not isinstance(self.tool_results, deque):
+            self.tool_results = deque(self.tool_results or (), maxlen=RECENT_RESULTS_MAXLEN)
+
     def to_dict(self) -> dict[str, Any]:
-        return {"done_action": self.done_action, "goal_list": self.goal_list,
-                "knowledge_list": self.knowledge_list, "memory_list": self.memory_list,
-                "tool_results": self.tool_results,
+        return {"done_action": list(self.done_action), "goal_list": self.goal_list,
+                "knowledge_list": list(self.knowledge_list), "memory_list": self.memory_list,
+                "tool_results": list(self.tool_results),
                 "last_successful_reply_action": self.last_successful_reply_action}
 
     @classmethod
     def from_dict(cls, data: dict) -> "ConversationInfo":
-        return cls(done_action=data.get("done_action", []), goal_list=data.get("goal_list", []),
-                   knowledge_list=data.get("knowledge_list", []), memory_list=data.get("memory_list", []),
-                   tool_results=data.get("tool_results", []),
+        return cls(done_action=data.get("done_action") or [], goal_list=data.get("goal_list", []),
+                   knowledge_list=data.get("knowledge_list") or [], memory_list=data.get("memory_list", []),
+                   tool_results=data.get("tool_results") or [],
                    last_successful_reply_action=data.get("last_successful_reply_action"))
 
 
-@dataclass
+@dataclass(slots=True)
 class ObservationInfo:
     """观察信息"""
-    chat_history: list[dict] = field(default_factory=list)
+    chat_history: deque[dict] = field(default_factory=lambda: deque(maxlen=CHAT_HISTORY_MAXLEN))
     chat_history_str: str = ""
     chat_history_count: int = 0
     unprocessed_messages: list[dict] = field(default_factory=list)
@@ -116,16 +153,22 @@ class ObservationInfo:
     last_message_time: Optional[float] = None
     last_message_sender: Optional[str] = None
     last_message_content: str = ""
+    # chat_history_str 的逐条渲染缓存（不参与序列化）
+    _render_cache: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.chat_history, deque):
+            self.chat_history = deque(self.chat_history or (), maxlen=CHAT_HISTORY_MAXLEN)
 
     def to_dict(self) -> dict[str, Any]:
-        return {"chat_history": self.chat_history, "chat_history_str": self.chat_history_str,
+        return {"chat_history": list(self.chat_history), "chat_history_str": self.chat_history_str,
                 "chat_history_count": self.chat_history_count, "unprocessed_messages": self.unprocessed_messages,
                 "new_messages_count": self.new_messages_count, "last_message_time": self.last_message_time,
                 "last_message_sender": self.last_message_sender, "last_message_content": self.last_message_content}
 
     @classmethod
     def from_dict(cls, data: dict) -> "ObservationInfo":
-        return cls(chat_history=data.get("chat_history", []), chat_history_str=data.get("chat_history_str", ""),
+        return cls(chat_history=data.get("chat_history") or [], chat_history_str=data.get("chat_history_str", ""),
                    chat_history_count=data.get("chat_history_count", 0),
                    unprocessed_messages=data.get("unprocessed_messages", []),
                    new_messages_count=data.get("new_messages_count", 0),
@@ -139,21 +182,39 @@ class ObservationInfo:
         from src.config.config import global_config
         from .shared import format_chat_history
 
-        self.chat_history.extend(self.unprocessed_messages)
-        if len(self.chat_history) > 100:
-            self.chat_history = self.chat_history[-100:]
+        # 消息突发时只有最后 CHAT_HISTORY_MAXLEN 条能留在历史中，更早的无需处理；
+        # 同一条消息被重复投递时（发送者、时间、内容均相同）只保留一次
+        pending = self.unprocessed_messages[-CHAT_HISTORY_MAXLEN:]
+        seen = set()
+        kept = []
+        for msg in pending:
+            key = (msg.get("user_id"), msg.get("time"), msg.get("content"))
+            if key in seen:
+                continue
+            seen.add(key)
+            kept.append(msg)
+
+        # chat_history 为定长队列，超出 CHAT_HISTORY_MAXLEN 的旧消息自动丢弃
+        self.chat_history.extend(kept)
 
         actual_bot_name = global_config.bot.nickname if global_config else bot_name
-        self.chat_history_str = format_chat_history(self.chat_history[-20:], actual_bot_name, "用户", 20)
+        self.chat_history_str = format_chat_history(
+            self.chat_history, actual_bot_name, "用户", 20, parts_cache=self._render_cache)
         self.unprocessed_messages = []
         self.new_messages_count = 0
         self.chat_history_count = len(self.chat_history)
 
 
-@dataclass
+@dataclass(slots=True)
 class WaitingConfig:
     max_wait_seconds: int = 300
     started_at: float = 0.0
+    # 超时时刻（墙上时钟，与会持久化的 started_at 一致），未激活时为 0.0；
+    # 由构造与 reset() 维护，因此不要直接修改上面两个字段
+    _deadline: float = field(default=0.0, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._deadline = self.started_at + self.max_wait_seconds if self.is_active() else 0.0
 
     def is_active(self) -> bool:
         return self.max_wait_seconds > 0 and self.started_at > 0
@@ -162,14 +223,16 @@ class WaitingConfig:
         return time.time() - self.started_at if self.is_active() else 0.0
 
     def is_timeout(self) -> bool:
-        return self.is_active() and self.get_elapsed_seconds() >= self.max_wait_seconds
+        deadline = self._deadline
+        return deadline != 0.0 and time.time() >= deadline
 
     def reset(self) -> None:
         self.max_wait_seconds = 0
         self.started_at = 0.0
+        self._deadline = 0.0
 
 
-@dataclass
+@dataclass(slots=True)
 class ActionModel:
     type: str
     params: dict[str, Any] = field(default_factory=dict)
@@ -184,11 +247,13 @@ class ActionModel:
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "ActionModel":
-        return cls(type=data.get("type", "wait"), reason=data.get("reason", ""),
-                   params={k: v for k, v in data.items() if k not in ("type", "reason")})
+        params = dict(data)
+        action_type = ACTION_TYPE_BY_VALUE.get(params.pop("type", None), ActionType.WAIT)
+        reason = params.pop("reason", "")
+        return cls(type=action_type, reason=reason, params=params)
 
 
-@dataclass
+@dataclass(slots=True)
 class PlanResponse:
     action: str
     reason: str
@@ -201,10 +266,23 @@ class PlanResponse:
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "PlanResponse":
-        return cls(action=data.get("action", "wait"), reason=data.get("reason", ""),
+        return cls(action=ACTION_TYPE_BY_VALUE.get(data.get("action"), ActionType.WAIT),
+                   reason=data.get("reason", ""),
                    actions=[ActionModel.from_dict(a) for a in data.get("actions", [])],
                    max_wait_seconds=data.get("max_wait_seconds", 0))
 
     @classmethod
     def create_default(cls) -> "PlanResponse":
-        return cls(action="wait", reason="默认等待")
\ No newline at end of file
+        return cls(action="wait", reason="默认等待")
+
+
+def dumps_model(obj: Any) -> str:
+    """将数据模型（带 to_dict 方法）序列化为 JSON 字符串，使用 msgspec/orjson 快速后端"""
+    from .shared import json_dumps
+    return json_dumps(obj.to_dict())
+
+
+def loads_model(data: str | bytes, cls: type[_ModelT]) -> _ModelT:
+    """从 JSON 字符串还原数据模型（cls 需提供 from_dict 类方法）"""
+    from .shared import json_loads
+    return cls.from_dict(json_loads(data))
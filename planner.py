@@ -8,7 +8,7 @@ from src.plugin_system.apis import llm_api
 from .session import PFCSession
 from .shared import (PersonalityHelper, get_current_time_str, build_goals_string, build_knowledge_string,
                      format_chat_history, format_new_messages, build_action_history_table, build_chat_history_table,
-                     get_items_from_json)
+                     get_items_from_json, take_last)
 
 logger = get_logger("pfc_planner")
 
@@ -267,7 +267,7 @@ class ActionPlanner:
         last_action_context = "关于你【上一次尝试】的行动：\n"
 
         try:
-            action_history_list = (self.session.conversation_info.done_action or [])[-5:]
+            action_history_list = take_last(self.session.conversation_info.done_action, 5)
         except Exception:
             action_history_list = []
 
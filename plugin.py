@@ -85,6 +85,16 @@ class PromptConfig:
     max_entry_length: int = 500               # 每条记录最大字符数（避免上下文过长）
     inject_system_prompt: bool = False        # 是否注入 MoFox 系统提示词（影响回复生成模型选择）
 
+@dataclass
+class PlannerConfig:
+    """行动规划配置"""
+    plan_cache_enabled: bool = True           # 是否缓存规划结果（目标与最近聊天记录未变化时复用上次规划）
+    plan_cache_ttl_seconds: float = 15.0      # 规划缓存有效期（秒）
+    speculative_prefetch: bool = False        # 是否在规划期间推测执行下一步（预测为重新思考目标时提前请求目标分析）
+    llm_timeout_seconds: float = 120.0        # 单次 LLM 请求（规划/生成/检查/知识获取）的超时时间（秒）
+    rate_limit_burst: int = 3                 # 规划限流：允许连续规划的次数（令牌桶容量）
+    rate_limit_refill_seconds: float = 2.0    # 规划限流：每恢复一次规划机会所需的时间（秒）
+
 @dataclass
 class PFCConfig:
     """PFC 总配置类
@@ -99,6 +109,7 @@ class PFCConfig:
     web_search: WebSearchConfig = field(default_factory=WebSearchConfig)  # 联网搜索配置
     tool: ToolConfig = field(default_factory=ToolConfig)              # 工具调用配置
     prompt: PromptConfig = field(default_factory=PromptConfig)        # 提示词配置
+    planner: PlannerConfig = field(default_factory=PlannerConfig)     # 行动规划配置
 
     @property
     def enabled_stream_types(self) -> list[str]:
@@ -166,6 +177,7 @@ def _load_config(plugin_cfg: dict[str, Any] | None) -> PFCConfig:
             web_search=_dict_to_dataclass(WebSearchConfig, get("web_search")),
             tool=_dict_to_dataclass(ToolConfig, get("tool")),
             prompt=_dict_to_dataclass(PromptConfig, get("prompt")),
+            planner=_dict_to_dataclass(PlannerConfig, get("planner")),
         )
     except Exception as e:
         logger.warning(f"配置加载失败，使用默认值: {e}")
@@ -176,7 +188,7 @@ def _load_config(plugin_cfg: dict[str, Any] | None) -> PFCConfig:
 # 插件类
 # ============================================================================
 
-CONFIG_VERSION = "1.5.0"
+CONFIG_VERSION = "1.6.3"
 
 @register_plugin
 class PrefrontalCortexChatterPlugin(BasePlugin):
@@ -193,6 +205,7 @@ class PrefrontalCortexChatterPlugin(BasePlugin):
         "inner": "配置元信息", "plugin": "插件基础配置", "waiting": "等待行为配置",
         "session": "会话管理配置", "reply_checker": "回复检查器配置",
         "web_search": "联网搜索配置", "tool": "工具调用配置", "prompt": "提示词配置",
+        "planner": "行动规划配置",
     }
 
     config_schema: ClassVar[dict[str, dict[str, ConfigField]]] = {
@@ -327,6 +340,38 @@ class PrefrontalCortexChatterPlugin(BasePlugin):
                 description="是否注入 MoFox 系统提示词"
             ),
         },
+        "planner": {
+            "plan_cache_enabled": ConfigField(
+                type=bool,
+                default=True,
+                description="是否缓存规划结果（目标与最近聊天记录未变化时复用上次规划，减少 LLM 调用）"
+            ),
+            "plan_cache_ttl_seconds": ConfigField(
+                type=float,
+                default=15.0,
+                description="规划缓存有效期（秒）"
+            ),
+            "speculative_prefetch": ConfigField(
+                type=bool,
+                default=False,
+                description="是否在规划期间推测执行下一步（预测为重新思考目标时提前请求目标分析，预测落空会多消耗一次 LLM 调用）"
+            ),
+            "llm_timeout_seconds": ConfigField(
+                type=float,
+                default=120.0,
+                description="单次 LLM 请求（规划/生成/检查/知识获取）的超时时间（秒）"
+            ),
+            "rate_limit_burst": ConfigField(
+                type=int,
+                default=3,
+                description="规划限流：允许连续规划的次数（消息连发时多余的重新规划会被合并）"
+            ),
+            "rate_limit_refill_seconds": ConfigField(
+                type=float,
+                default=2.0,
+                description="规划限流：每恢复一次规划机会所需的时间（秒）"
+            ),
+        },
     }
 
     async def on_plugin_loaded(self):
@@ -350,6 +395,11 @@ class PrefrontalCortexChatterPlugin(BasePlugin):
             raise RuntimeError(f"PFC 数据库初始化失败: {e}")
 
     async def on_plugin_unloaded(self):
+        try:
+            from .db_storage import close_db_storage
+            await close_db_storage()
+        except Exception as e:
+            logger.error(f"[PFC] 会话落库失败: {e}")
         logger.info("[PFC] 插件已卸载")
 
     def get_plugin_components(self):
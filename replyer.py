@@ -1,5 +1,6 @@
 """PFC 回复生成器模块 - 根据不同行动类型生成回复内容 (GPL-3.0)"""
 
+import difflib
 import time
 from typing import List, Dict, Any, TYPE_CHECKING
 
@@ -7,7 +8,8 @@ from src.common.logger import get_logger
 from src.plugin_system.apis import llm_api
 from src.config.config import global_config
 from .models import ObservationInfo, ConversationInfo
-from .shared import PersonalityHelper, get_current_time_str, translate_timestamp, build_goals_string, build_knowledge_string
+from .shared import (PersonalityHelper, get_current_time_str, translate_timestamp, build_goals_string,
+                     build_knowledge_string, json_loads, take_last, to_bool)
 
 if TYPE_CHECKING:
     from .plugin import PFCConfig
@@ -31,19 +33,31 @@ def check_basic_reply_quality(reply: str, max_length: int = 500) -> tuple[bool,
 def check_reply_similarity(reply: str, chat_history: list, threshold: float = 0.8) -> tuple[bool, str]:
     if not chat_history:
         return True, ""
-    for msg in reversed(chat_history[-5:]):
+    for msg in reversed(take_last(chat_history, 5)):
         if msg.get("type") == "bot_message":
             content = msg.get("content", "")
             if content == reply:
                 return False, "回复内容与你上一条发言完全相同"
-            import difflib
-            ratio = difflib.SequenceMatcher(None, reply, content).ratio()
-            if ratio > threshold:
+            ratio = _similarity_above(reply, content, threshold)
+            if ratio is not None:
                 return False, f"回复内容与你上一条发言高度相似 (相似度 {ratio:.2f})"
             break
     return True, ""
 
 
+def _similarity_above(a: str, b: str, threshold: float) -> float | None:
+    """相似度超过阈值时返回相似度，否则返回 None
+    
+    先用开销更低的上界 (real_quick_ratio / quick_ratio) 排除不可能超过阈值的情况，
+    结果与直接比较 difflib 的 ratio 一致。
+    """
+    matcher = difflib.SequenceMatcher(None, a, b)
+    if matcher.real_quick_ratio() <= threshold or matcher.quick_ratio() <= threshold:
+        return None
+    ratio = matcher.ratio()
+    return ratio if ratio > threshold else None
+
+
 PROMPT_DIRECT_REPLY = """{persona_text}
 
 【回复风格要求】
@@ -140,7 +154,7 @@ class ReplyGenerator:
     async def _build_prompt_params(self, observation_info: ObservationInfo, conversation_info: ConversationInfo) -> Dict[str, str]:
         personality_info = await self._personality_helper.get_personality_info()
         goals_str = build_goals_string(conversation_info.goal_list)
-        knowledge_info_str = build_knowledge_string(getattr(conversation_info, 'knowledge_list', None))
+        knowledge_info_str = build_knowledge_string(conversation_info.knowledge_list)
         chat_history_text = await self._build_chat_history_text(observation_info)
         tool_info_str = await self._build_tool_info(chat_history_text, observation_info)
         
@@ -161,12 +175,12 @@ class ReplyGenerator:
 
     def _build_tool_results_string(self, conversation_info: ConversationInfo) -> str:
         """构建工具结果字符串"""
-        tool_results = getattr(conversation_info, 'tool_results', None)
+        tool_results = conversation_info.tool_results
         if not tool_results:
             return ""
         
         # 只显示最近的工具结果
-        recent_results = tool_results[-5:]
+        recent_results = take_last(tool_results, 5)
         if not recent_results:
             return ""
         
@@ -204,6 +218,8 @@ class ReplyGenerator:
     def _format_messages(self, messages: List[Dict[str, Any]], timestamp_mode: str = "relative") -> str:
         if not messages:
             return ""
+        bot_qq = str(global_config.bot.qq_account) if global_config and global_config.bot else None
+        bot_name = self.bot_name
         formatted_blocks = []
         for msg in messages:
             sender = msg.get("sender", {})
@@ -212,8 +228,8 @@ class ReplyGenerator:
             content = msg.get("processed_plain_text", msg.get("content", ""))
             timestamp = msg.get("time", time.time())
             user_id = sender.get("user_id", msg.get("user_id", ""))
-            if global_config and global_config.bot and str(user_id) == str(global_config.bot.qq_account):
-                sender_name = f"{self.bot_name}(你)"
+            if bot_qq is not None and str(user_id) == bot_qq:
+                sender_name = f"{bot_name}(你)"
             else:
                 sender_name = user_name or sender_name
             readable_time = translate_timestamp(timestamp, mode=timestamp_mode)
@@ -310,17 +326,16 @@ class ReplyChecker:
             return False if retry_count >= self.max_retries else False, "检查过程出错", retry_count >= self.max_retries
 
     def _parse_llm_response(self, content: str, retry_count: int) -> tuple[bool, str, bool]:
-        import json
         import re
         content = content.strip()
         try:
-            result = json.loads(content)
-        except json.JSONDecodeError:
+            result = json_loads(content)
+        except ValueError:
             json_match = re.search(r"\{[^{}]*\}", content)
             if json_match:
                 try:
-                    result = json.loads(json_match.group())
-                except json.JSONDecodeError:
+                    result = json_loads(json_match.group())
+                except ValueError:
                     return self._fallback_parse(content, retry_count)
             else:
                 return self._fallback_parse(content, retry_count)
@@ -330,7 +345,7 @@ class ReplyChecker:
         need_replan = result.get("need_replan", False)
 
         if isinstance(suitable, str):
-            suitable = suitable.lower() == "true"
+            suitable = to_bool(suitable)
         if suitable is None:
             suitable = "不合适" not in reason.lower() and "违规" not in reason.lower()
 
@@ -5,7 +5,8 @@ import time
 from typing import Optional
 
 from src.common.logger import get_logger
-from .models import ConversationInfo, ConversationState, ObservationInfo, WaitingConfig
+from .models import (CHAT_HISTORY_MAXLEN, CONVERSATION_STATE_BY_VALUE, ConversationInfo, ConversationState,
+                     ObservationInfo, WaitingConfig)
 from .shared import translate_timestamp
 
 logger = get_logger("pfc_session")
@@ -13,7 +14,7 @@ logger = get_logger("pfc_session")
 
 class PFCSession:
     """PFC 会话"""
-    MAX_HISTORY_SIZE = 100
+    MAX_HISTORY_SIZE = CHAT_HISTORY_MAXLEN
 
     def __init__(self, user_id: str, stream_id: str):
         self.user_id = user_id
@@ -34,6 +35,8 @@ class PFCSession:
         self.last_user_speak_time: float | None = None
         self.generated_reply: str = ""
         self._history_loaded_from_db: bool = False
+        self._last_save_fp: bytes | None = None  # 上次成功写入数据库的会话行指纹
+        self._db_pk: int | None = None  # 数据库会话行主键，首次保存后记录
 
     @property
     def state(self) -> ConversationState:
@@ -78,21 +81,33 @@ class PFCSession:
             self.conversation_info.goal_list = filtered
 
     def add_bot_message(self, content: str, timestamp: float | None = None) -> None:
+        self.add_bot_messages([(content, timestamp or time.time())])
+
+    def add_bot_messages(self, messages: list[tuple[str, float]]) -> None:
+        """批量记录机器人发言（多行回复一次性并入历史）
+
+        Args:
+            messages: (内容, 发送时间) 列表，每行保留各自的实际发送时间
+        """
+        if not messages:
+            return
         from src.config.config import global_config
-        msg_time = timestamp or time.time()
-        self.observation_info.chat_history.append({"type": "bot_message", "content": content, "time": msg_time})
-        self.observation_info.chat_history_count += 1
-        self.last_bot_speak_time = msg_time
+        obs = self.observation_info
+        obs.chat_history.extend(
+            {"type": "bot_message", "content": content, "time": msg_time} for content, msg_time in messages)
+        obs.chat_history_count = len(obs.chat_history)
+        self.last_bot_speak_time = messages[-1][1]
 
         bot_name = global_config.bot.nickname if global_config else "Bot"
-        readable_time = translate_timestamp(msg_time)
-        stripped = content.strip()
-        if stripped.endswith("。"):
-            stripped = stripped[:-1]
-        bot_block = f"{readable_time} {bot_name}(你) 说:\n{stripped};\n"
-        self.observation_info.chat_history_str = (self.observation_info.chat_history_str + "\n" + bot_block
-                                                   if self.observation_info.chat_history_str else bot_block)
-        self._trim_history()
+        blocks = []
+        for content, msg_time in messages:
+            stripped = content.strip()
+            if stripped.endswith("。"):
+                stripped = stripped[:-1]
+            blocks.append(f"{translate_timestamp(msg_time)} {bot_name}(你) 说:\n{stripped};\n")
+        if obs.chat_history_str:
+            blocks.insert(0, obs.chat_history_str)
+        obs.chat_history_str = "\n".join(blocks)
         self.update_activity()
 
     def get_time_info(self) -> str:
@@ -104,14 +119,18 @@ class PFCSession:
             time_info += f"\n距离对方上次发言已经过去了{int(current_time - self.last_user_speak_time)}秒"
         return time_info
 
-    def _trim_history(self) -> None:
-        if len(self.observation_info.chat_history) > self.MAX_HISTORY_SIZE:
-            self.observation_info.chat_history = self.observation_info.chat_history[-self.MAX_HISTORY_SIZE:]
-            self.observation_info.chat_history_count = len(self.observation_info.chat_history)
+    async def drain_and_reset(self) -> int:
+        """将未处理消息并入聊天历史并重置新消息计数
+
+        clear_unprocessed_messages 内部没有 await，整个过程在事件循环中不会被其他写入者打断
 
-    async def clear_unprocessed_messages(self) -> None:
+        Returns:
+            本次并入前的新消息计数
+        """
+        drained = self.observation_info.new_messages_count
         await self.observation_info.clear_unprocessed_messages()
-        self._trim_history()
+        self.observation_info.new_messages_count = 0
+        return drained
 
     def start_waiting(self, max_wait_seconds: int = 300) -> None:
         if max_wait_seconds <= 0:
@@ -172,10 +191,7 @@ class PFCSession:
     @classmethod
     def from_dict(cls, data: dict) -> "PFCSession":
         session = cls(user_id=data.get("user_id", ""), stream_id=data.get("stream_id", ""))
-        try:
-            session._state = ConversationState(data.get("state", "init"))
-        except ValueError:
-            session._state = ConversationState.INIT
+        session._state = CONVERSATION_STATE_BY_VALUE.get(data.get("state"), ConversationState.INIT)
         session.should_continue = data.get("should_continue", True)
         session.ignore_until_timestamp = data.get("ignore_until_timestamp")
         session.conversation_info = ConversationInfo.from_dict(data.get("conversation_info", {}))
@@ -264,6 +280,8 @@ class SessionManager:
         for user_id in list(self._sessions.keys()):
             if await self.save_session(user_id):
                 count += 1
+        # 保存为写回队列，这里等待全部落库
+        await self._get_db_storage().flush()
         return count
 
     async def get_waiting_sessions(self) -> list[PFCSession]:
@@ -6,18 +6,37 @@
 3. 文本构建工具 - 构建目标、知识、历史等格式化文本
 4. JSON 解析工具 - 从 LLM 响应中提取 JSON 数据
 5. 通用工具函数 - 文本处理、时间计算等
+6. 缓存工具 - 带过期时间的 LRU 缓存
+7. 提示词模板 - 预解析占位符的模板
 """
 
-import datetime
 import json
+import logging
 import re
+import string
 import time
-from typing import Any, Optional
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Hashable, Optional
 
 from src.common.logger import get_logger
 from src.config.config import global_config
 from src.individuality.individuality import get_individuality
 
+try:
+    import msgspec
+except ImportError:  # msgspec 为可选依赖
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，缺失时回退到标准库 json
+    orjson = None
+
+# JSON 后端优先级：msgspec > orjson > 标准库 json
+_msgspec_encoder = msgspec.json.Encoder() if msgspec is not None else None
+_msgspec_decoder = msgspec.json.Decoder() if msgspec is not None else None
+
 logger = get_logger("pfc_shared")
 
 
@@ -47,22 +66,39 @@ def translate_timestamp(timestamp: float, mode: str = "relative") -> str:
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
 
 
+_WEEKDAYS = ("星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日")
+# 按小时索引的时段名称（0-23 时）
+_HOUR_PERIOD = ("深夜",) * 5 + ("早上",) * 4 + ("上午",) * 3 + ("中午",) * 2 + ("下午",) * 4 + ("晚上",) * 4 + ("深夜",) * 2
+# (分钟序号, 时间字符串)；结果精确到分钟，同一分钟内直接复用
+_time_str_cache: tuple[int, str] = (-1, "")
+
+
 def get_current_time_str() -> str:
     """获取当前时间的人类可读格式
     
     Returns:
         格式化的当前时间，如 "2024年12月01日 星期五 下午 14:30"
     """
-    now = datetime.datetime.now()
-    weekdays = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
-    hour = now.hour
-    periods = [(5, 9, "早上"), (9, 12, "上午"), (12, 14, "中午"), (14, 18, "下午"), (18, 22, "晚上")]
-    time_period = "深夜"
-    for start, end, period in periods:
-        if start <= hour < end:
-            time_period = period
-            break
-    return now.strftime(f"%Y年%m月%d日 {weekdays[now.weekday()]} {time_period} %H:%M")
+    global _time_str_cache
+    now = time.time()
+    minute = int(now // 60)
+    if _time_str_cache[0] == minute:
+        return _time_str_cache[1]
+    t = time.localtime(now)
+    time_str = (f"{t.tm_year}年{t.tm_mon:02d}月{t.tm_mday:02d}日 {_WEEKDAYS[t.tm_wday]} "
+                f"{_HOUR_PERIOD[t.tm_hour]} {t.tm_hour:02d}:{t.tm_min:02d}")
+    _time_str_cache = (minute, time_str)
+    return time_str
+
+
+# 进程级人格信息缓存：人格在运行期间不变，所有会话与助手实例共享同一次加载结果
+_personality_info_cache: Optional[str] = None
+
+
+def invalidate_personality_cache() -> None:
+    """清除进程级人格信息缓存（人格配置热重载后调用）"""
+    global _personality_info_cache
+    _personality_info_cache = None
 
 
 class PersonalityHelper:
@@ -86,15 +122,24 @@ class PersonalityHelper:
 
     async def get_personality_info(self) -> str:
         if self._personality_info is None:
-            self._personality_info = await self._load_personality_info()
+            self._personality_info = _personality_info_cache or await self._load_personality_info()
         return self._personality_info
 
+    def invalidate(self) -> None:
+        """丢弃已缓存的人格信息（包括进程级缓存），下次获取时重新加载"""
+        self._personality_info = None
+        invalidate_personality_cache()
+
     async def _load_personality_info(self) -> str:
+        global _personality_info_cache
         try:
             individuality = get_individuality()
             base_personality = await individuality.get_personality_block()
             background = self._get_background_story()
-            return f"{base_personality}\n\n【背景信息】\n{background}" if background else base_personality
+            info = f"{base_personality}\n\n【背景信息】\n{background}" if background else base_personality
+            # 只缓存成功加载的结果；失败时的配置回退值仅在本实例内复用
+            _personality_info_cache = info
+            return info
         except Exception as e:
             logger.warning(f"[PFC][{self.user_name}] 获取人格信息失败: {e}")
             return self._build_personality_from_config()
@@ -167,7 +212,7 @@ def build_knowledge_string(knowledge_list: list[dict[str, Any]] | None) -> str:
     if not knowledge_list:
         return result + "- 暂无相关知识和记忆。\n"
     try:
-        for i, item in enumerate(knowledge_list[-5:]):
+        for i, item in enumerate(take_last(knowledge_list, 5)):
             if isinstance(item, dict):
                 query = item.get("query", "未知查询")
                 knowledge = item.get("knowledge", "无知识内容")
@@ -180,8 +225,23 @@ def build_knowledge_string(knowledge_list: list[dict[str, Any]] | None) -> str:
     return result
 
 
+def _chat_message_parts(msg: dict, bot_name: str, user_name: str) -> Optional[tuple[str, str]]:
+    """拆出消息中与时间无关的部分：(说话人, 内容行)，非聊天消息返回 None"""
+    msg_type = msg.get("type", "")
+    if msg_type == "user_message":
+        speaker = msg.get("user_name", user_name)
+    elif msg_type == "bot_message":
+        speaker = f"{bot_name}(你)"
+    else:
+        return None
+    content = msg.get("content", "").strip()
+    body = f"{content[:-1] if content.endswith('。') else content};" if content else ""
+    return speaker, body
+
+
 def format_chat_history(chat_history: list[dict[str, Any]], bot_name: str = "Bot",
-                        user_name: str = "用户", max_messages: int = 30) -> str:
+                        user_name: str = "用户", max_messages: int = 30,
+                        parts_cache: Optional[dict] = None) -> str:
     """格式化聊天历史为可读文本
     
     Args:
@@ -189,6 +249,8 @@ def format_chat_history(chat_history: list[dict[str, Any]], bot_name: str = "Bot
         bot_name: Bot 名称
         user_name: 用户名称
         max_messages: 最多保留的消息条数
+        parts_cache: 可选的渲染缓存（由调用方持有，同一缓存需使用相同的名称参数）；
+            已渲染过的消息只重新计算相对时间，缓存只保留本次用到的消息
     
     Returns:
         格式化的聊天历史文本
@@ -196,23 +258,28 @@ def format_chat_history(chat_history: list[dict[str, Any]], bot_name: str = "Bot
     if not chat_history:
         return "还没有聊天记录。"
 
-    def format_message(msg: dict) -> list[str]:
-        msg_type = msg.get("type", "")
-        content = msg.get("content", "").strip()
-        readable_time = translate_timestamp(msg.get("time", time.time()))
-        if msg_type == "user_message":
-            header = f"{readable_time} {msg.get('user_name', user_name)} 说:"
-        elif msg_type == "bot_message":
-            header = f"{readable_time} {bot_name}(你) 说:"
+    fresh = {} if parts_cache is not None else None
+    formatted = []
+    for msg in take_last(chat_history, max_messages):
+        key = id(msg)
+        cached = parts_cache.get(key) if parts_cache is not None else None
+        if cached is not None and cached[0] is msg:
+            parts = cached[1]
         else:
-            return []
-        result = [header]
-        if content:
-            result.append(f"{content[:-1] if content.endswith('。') else content};")
-        result.append("")
-        return result
-
-    formatted = [line for msg in chat_history[-max_messages:] for line in format_message(msg)]
+            parts = _chat_message_parts(msg, bot_name, user_name)
+        if fresh is not None:
+            fresh[key] = (msg, parts)
+        if parts is None:
+            continue
+        speaker, body = parts
+        formatted.append(f"{translate_timestamp(msg.get('time', time.time()))} {speaker} 说:")
+        if body:
+            formatted.append(body)
+        formatted.append("")
+
+    if parts_cache is not None:
+        parts_cache.clear()
+        parts_cache.update(fresh)
     return "\n".join(formatted).strip() or "还没有聊天记录。"
 
 
@@ -287,7 +354,7 @@ def build_chat_history_table(chat_history: list[dict[str, Any]], bot_name: str =
     if not chat_history:
         return "还没有聊天记录。"
     rows = []
-    for idx, msg in enumerate(chat_history[-max_messages:], 1):
+    for idx, msg in enumerate(take_last(chat_history, max_messages), 1):
         msg_type = msg.get("type", "")
         if msg_type == "user_message":
             speaker = msg.get("user_name", user_name)
@@ -326,6 +393,16 @@ def get_items_from_json(text: str, *keys: str, default: Any = None) -> tuple:
     return tuple(json_obj.get(key, default) for key in keys)
 
 
+# LLM 在 JSON 中以字符串形式给出布尔值时视为真的取值
+# （比较前去除首尾空白并转为小写）
+_TRUE_STRINGS = frozenset({"true", "1", "yes"})
+
+
+def to_bool(value: Any) -> bool:
+    """将 LLM 返回的 JSON 值转为布尔值（字符串按 _TRUE_STRINGS 判断）"""
+    return value.strip().lower() in _TRUE_STRINGS if isinstance(value, str) else bool(value)
+
+
 def extract_json_from_text(text: str) -> Optional[dict]:
     """从文本中提取 JSON 对象
     
@@ -357,7 +434,7 @@ def extract_json_from_text(text: str) -> Optional[dict]:
             if process is None and callable(pattern_func):
                 result = pattern_func(text)
                 if isinstance(result, str):
-                    parsed = json.loads(result)
+                    parsed = json_loads(result)
                     logger.debug(f"[PFC] extract_json_from_text: 使用'{pattern_name}'成功解析")
                     return parsed
             matches = pattern_func(text)
@@ -365,13 +442,13 @@ def extract_json_from_text(text: str) -> Optional[dict]:
                 logger.debug(f"[PFC] extract_json_from_text: '{pattern_name}'找到{len(matches)}个匹配")
                 for i, match in enumerate(matches):
                     try:
-                        parsed = json.loads(match.strip() if process == 'strip' else match)
+                        parsed = json_loads(match.strip() if process == 'strip' else match)
                         logger.debug(f"[PFC] extract_json_from_text: 使用'{pattern_name}'第{i+1}个匹配成功解析")
                         return parsed
-                    except json.JSONDecodeError as e:
+                    except ValueError as e:
                         logger.debug(f"[PFC] extract_json_from_text: '{pattern_name}'第{i+1}个匹配解析失败: {e}")
                         continue
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             logger.debug(f"[PFC] extract_json_from_text: '{pattern_name}'解析失败: {e}")
             continue
     logger.warning(f"[PFC] extract_json_from_text: 所有模式都无法解析JSON, 文本={text[:200]!r}")
@@ -395,17 +472,33 @@ def extract_json_array_from_text(text: str) -> Optional[list]:
                 lambda t: re.findall(r'\[[\s\S]*\]', t)]
 
     for pattern_func in patterns:
-        candidates = [pattern_func(text)] if not isinstance(pattern_func(text), list) else pattern_func(text)
+        candidates = pattern_func(text)
+        if not isinstance(candidates, list):
+            candidates = [candidates]
         for candidate in candidates:
             try:
-                result = json.loads(candidate)
+                result = json_loads(candidate)
                 if isinstance(result, list):
                     return result
-            except (json.JSONDecodeError, TypeError):
+            except (ValueError, TypeError):
                 continue
     return None
 
 
+def is_debug_enabled(log: Any) -> bool:
+    """判断日志器当前是否输出 DEBUG 日志，用于跳过昂贵的调试信息拼接
+    
+    日志器不支持级别查询时保守地返回 True。
+    """
+    is_enabled_for = getattr(log, "isEnabledFor", None)
+    if is_enabled_for is None:
+        return True
+    try:
+        return is_enabled_for(logging.DEBUG)
+    except Exception:
+        return True
+
+
 def truncate_text(text: str, max_length: int = 100, suffix: str = "...") -> str:
     """截断文本到指定长度
     
@@ -422,6 +515,25 @@ def truncate_text(text: str, max_length: int = 100, suffix: str = "...") -> str:
     return text[:max_length - len(suffix)] + suffix
 
 
+def take_last(items, n: int) -> list:
+    """取序列末尾的 n 项（兼容 list 与 deque，deque 不支持切片）
+    
+    Args:
+        items: 列表或双端队列
+        n: 数量
+    
+    Returns:
+        按原顺序排列的末尾 n 项
+    """
+    if not items or n <= 0:
+        return []
+    if isinstance(items, list):
+        return items[-n:]
+    tail = list(islice(reversed(items), n))
+    tail.reverse()
+    return tail
+
+
 def format_time_delta(seconds: float) -> str:
     """格式化时间差为人类可读格式
     
@@ -483,6 +595,49 @@ def safe_json_dumps(obj: Any, ensure_ascii: bool = False, indent: Optional[int]
         return "{}"
 
 
+def json_dumps(obj: Any) -> str:
+    """序列化为 JSON 字符串（保留非 ASCII 字符）
+    
+    依次尝试 msgspec、orjson，未安装或遇到其不支持的对象时回退到标准库。
+    
+    Args:
+        obj: 要序列化的对象
+    
+    Returns:
+        JSON 字符串
+    """
+    if _msgspec_encoder is not None:
+        try:
+            return _msgspec_encoder.encode(obj).decode()
+        except TypeError:
+            pass
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def json_loads(data: str | bytes) -> Any:
+    """解析 JSON 字符串（优先使用 msgspec / orjson）
+    
+    快速解析器拒绝的输入（如 NaN / Infinity 等标准库可接受的扩展写法）会再用标准库重试；
+    解析失败时统一抛出 ValueError（json 的 JSONDecodeError 为其子类）。
+    """
+    if _msgspec_decoder is not None:
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError:
+            pass
+    elif orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
 def merge_dicts(base: dict, override: dict) -> dict:
     """深度合并两个字典
     
@@ -592,4 +747,80 @@ def calculate_response_urgency(time_since_last_message: float, is_mentioned: boo
         urgency += 0.2
     elif message_count > 1:
         urgency += 0.1
-    return min(urgency, 1.0)
\ No newline at end of file
+    return min(urgency, 1.0)
+
+
+# ============================================================================
+# 缓存工具
+# ============================================================================
+
+class TTLCache:
+    """带过期时间的 LRU 缓存
+
+    条目在写入 ttl 秒后失效；超过 maxsize 时淘汰最久未使用的条目。
+    过期判断使用单调时钟，不受系统时间调整影响。
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，未命中或已过期时返回 default"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """写入缓存"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """移除并返回缓存条目"""
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# ============================================================================
+# 提示词模板
+# ============================================================================
+
+class PromptTemplate:
+    """预解析的提示词模板
+    
+    与 str.format 语法一致（支持 {{ }} 转义），但只在构造时解析一次占位符，
+    渲染时按顺序拼接常量片段与参数值。仅支持简单的命名占位符。
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts: list[tuple[str, Optional[str]]] = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+            if field_name is not None and (not field_name or format_spec or conversion):
+                raise ValueError(f"不支持的占位符: {{{field_name}}}")
+            self._parts.append((literal, field_name))
+
+    def format(self, **params: Any) -> str:
+        """填充参数生成提示词，缺少参数时抛出 KeyError（与 str.format 一致）"""
+        chunks = []
+        for literal, field_name in self._parts:
+            chunks.append(literal)
+            if field_name is not None:
+                chunks.append(str(params[field_name]))
+        return "".join(chunks)
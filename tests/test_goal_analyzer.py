@@ -0,0 +1,35 @@
+"""GoalAnalyzer 目标响应解析测试（需在宿主项目 plugins 目录下运行）"""
+
+import pytest
+
+goal_analyzer = pytest.importorskip("plugins.prefrontal_cortex_chatter.goal_analyzer")
+models = pytest.importorskip("plugins.prefrontal_cortex_chatter.models")
+
+
+def _parse(content):
+    analyzer = goal_analyzer.GoalAnalyzer.__new__(goal_analyzer.GoalAnalyzer)
+    info = models.ConversationInfo()
+    return analyzer._parse_goal_response(content, info), info
+
+
+def test_object_wrapped_in_prose_with_brackets():
+    result, info = _parse('好的[思考]\n{"goal": "安慰对方", "reasoning": "对方情绪低落"}')
+    assert result == ("安慰对方", "", "对方情绪低落")
+    assert info.goal_list == [{"goal": "安慰对方", "reasoning": "对方情绪低落"}]
+
+
+def test_goals_array_wrapped_in_object():
+    result, info = _parse('{"goals": [{"goal": "继续聊天", "reasoning": "话题未结束"}]}')
+    assert result == ("继续聊天", "", "话题未结束")
+    assert len(info.goal_list) == 1
+
+
+def test_plain_array():
+    result, info = _parse('[{"goal": "a", "reasoning": "x"}, {"goal": "b", "reasoning": "y"}]')
+    assert result == ("a", "", "x")
+    assert [g["goal"] for g in info.goal_list] == ["a", "b"]
+
+
+def test_unparseable_returns_empty():
+    result, _ = _parse("没有任何JSON")
+    assert result == ("", "", "")